@@ -14,12 +14,20 @@
 #  DB 12   ; a decimal byte
 #  DB 0b0001 ; a binary byte
 
+import collections
+import contextlib
+import hashlib
+import heapq
+import io
 import sys
 import re
+import struct
+import zlib
 
 # Opcodes
 OPCODES = {
     "ADD":  {"type": 2, "code": "10100000"},
+    "ADDI": {"type": 8, "code": "10000110"},
     "AND":  {"type": 2, "code": "10101000"},
     "CALL": {"type": 1, "code": "01010000"},
     "CMP":  {"type": 2, "code": "10100111"},
@@ -55,6 +63,20 @@ OPCODES = {
     "XOR":  {"type": 2, "code": "10101011"},
 }
 
+# Opcode bytes, for pass1's binary output
+OPCODE_BYTES = {name: int(info["code"], 2) for name, info in OPCODES.items()}
+
+# Binary image formats, picked by output file extension. Must match the
+# loader in ls8/cpu.py:
+#   .bin   raw program bytes
+#   .ls8b  header (magic "LS8B", version, entry point, code length, CRC-32 of
+#          the code, symbol count), the code bytes, then the symbol table
+#          as (name length, name, address) entries. Little-endian.
+IMAGE_MAGIC = b"LS8B"
+IMAGE_VERSION = 1
+IMAGE_HEADER = struct.Struct("<4sBBHIH")
+BINARY_EXTENSIONS = (".ls8b", ".bin")
+
 # Regex for matching lines
 # Capturing groups: label, opcode, operandA, operandB
 REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?"
@@ -63,12 +85,27 @@ REGEX = r"(?:(\w+?):)?\s*(?:(\w+)\s*(?:(\w+)(?:\s*,\s*(\w+))?)?)?"
 REGEX_DS = r"(?:(\w+?):)?\s*DS\s*(.+)"  # insensitive
 REGEX_DB = r"(?:(\w+?):)?\s*DB\s*(.+)"  # insensitive
 
+# Compiled once rather than looked up in the re cache for every line
+LINE_RE = re.compile(REGEX)
+DS_RE = re.compile(REGEX_DS, re.IGNORECASE)
+DB_RE = re.compile(REGEX_DB, re.IGNORECASE)
+REG_RE = re.compile(r"R([0-7])")
+
 
 def parse_commandline(argv):
     """
-    Usage: asm.py [inputfile] [outputfile]
+    Usage: asm.py [--stream | -O] [inputfile] [outputfile]
     """
 
+    stream = "--stream" in argv
+    optimize = "-O" in argv
+    argv = [arg for arg in argv if arg not in ("--stream", "-O")]
+
+    if stream and optimize:
+        print("asm.py: -O needs the whole program and cannot be used with --stream",
+              file=sys.stderr)
+        sys.exit(1)
+
     if len(argv) == 1:
         inputfile = "-"
         outputfile = "-"
@@ -82,10 +119,10 @@ def parse_commandline(argv):
         outputfile = argv[2]
 
     else:
-        print("usage: asm.py [infile.asm] [outfile.ls8]", file=sys.stderr)
+        print("usage: asm.py [--stream | -O] [infile.asm] [outfile.ls8]", file=sys.stderr)
         sys.exit(1)
 
-    return inputfile, outputfile
+    return inputfile, outputfile, stream, optimize
 
 
 def open_files(inputfile, outputfile):
@@ -101,6 +138,9 @@ def open_files(inputfile, outputfile):
 
     if outputfile == "-":
         outputfile = sys.stdout
+    elif outputfile.endswith(BINARY_EXTENSIONS):
+        # Readable too, so a streamed image can be checksummed at the end
+        outputfile = open(outputfile, "w+b")
     else:
         outputfile = open(outputfile, "w")
 
@@ -127,7 +167,7 @@ def p8(v):
     return "{:08b}".format(v)
 
 
-def pass1(inputfile, sym, code):
+def pass1(inputfile, sym, code, binary=False):
     """
     Pass 1
 
@@ -135,6 +175,11 @@ def pass1(inputfile, sym, code):
     * Parse labels, opcodes, and operands
     * Record label offsets
     * Emit machine code
+
+    Machine code is emitted as `.ls8` text lines, or with `binary` as ints
+    (one per byte), so binary images are built without formatting and
+    parsing back binary strings. Label comments and `sym:` references are
+    strings either way.
     """
 
     # Source line number
@@ -148,7 +193,7 @@ def pass1(inputfile, sym, code):
 
         nonlocal line_num
 
-        m = re.match(r"R([0-7])", op)
+        m = REG_RE.match(op)
 
         if m is None:
             if fatal:
@@ -165,7 +210,7 @@ def pass1(inputfile, sym, code):
 
         nonlocal addr
 
-        code.append(f"{machine_code} # {opcode}")
+        code.append(machine_code if binary else f"{machine_code} # {opcode}")
         addr += 1
 
     def out1(opcode, op_a, op_b, machine_code):
@@ -174,8 +219,8 @@ def pass1(inputfile, sym, code):
         nonlocal addr
 
         reg_a = get_reg(op_a)
-        code.append(f"{machine_code} # {opcode} {op_a}")
-        code.append(p8(reg_a))
+        code.append(machine_code if binary else f"{machine_code} # {opcode} {op_a}")
+        code.append(reg_a if binary else p8(reg_a))
         addr += 2
 
     def out2(opcode, op_a, op_b, machine_code):
@@ -186,9 +231,9 @@ def pass1(inputfile, sym, code):
         reg_a = get_reg(op_a)
         reg_b = get_reg(op_b)
 
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
-        code.append(p8(reg_b))
+        code.append(machine_code if binary else f"{machine_code} # {opcode} {op_a},{op_b}")
+        code.append(reg_a if binary else p8(reg_a))
+        code.append(reg_b if binary else p8(reg_b))
 
         addr += 3
 
@@ -201,14 +246,14 @@ def pass1(inputfile, sym, code):
 
         try:
             val_b = int(op_b, 0)
-            out_b = p8(val_b)
+            out_b = val_b & 0xff if binary else p8(val_b)
 
         except ValueError:
             # If it's not a value, it might be a symbol
             out_b = f"sym:{op_b}"
 
-        code.append(f"{machine_code} # {opcode} {op_a},{op_b}")
-        code.append(p8(reg_a))
+        code.append(machine_code if binary else f"{machine_code} # {opcode} {op_a},{op_b}")
+        code.append(reg_a if binary else p8(reg_a))
         code.append(out_b)
 
         addr += 3
@@ -220,7 +265,7 @@ def pass1(inputfile, sym, code):
 
         nonlocal addr
 
-        m = re.match(REGEX_DS, line, re.IGNORECASE)
+        m = DS_RE.match(line)
 
         if m is None or m.group(2) is None:
             print(f"line {line_num}: missing argument to DS", file=sys.stderr)
@@ -228,6 +273,12 @@ def pass1(inputfile, sym, code):
 
         data = m.group(2)
 
+        if binary:
+            for c in data:
+                code.append(ord(c) & 0xff)
+            addr += len(data)
+            return
+
         for i in range(len(data)):
             print_char = data[i]
 
@@ -245,7 +296,7 @@ def pass1(inputfile, sym, code):
 
         nonlocal addr
 
-        m = re.match(REGEX_DB, line, re.IGNORECASE)
+        m = DB_RE.match(line)
 
         if m is None or m.group(2) is None:
             print(f"line {line}: missing argument to DB", file=sys.stderr)
@@ -264,7 +315,7 @@ def pass1(inputfile, sym, code):
         # Force to byte size
         val &= 0xff
 
-        code.append(f"{p8(val)} # {data}")
+        code.append(val if binary else f"{p8(val)} # {data}")
 
         addr += 1
 
@@ -330,7 +381,7 @@ def pass1(inputfile, sym, code):
 
         # print(line)  # debug
 
-        m = re.match(REGEX, line)
+        m = LINE_RE.match(line)
 
         if m is not None:
             label, opcode, op_a, op_b = normalize_line(m.groups())
@@ -355,48 +406,632 @@ def pass1(inputfile, sym, code):
                     # Handle opcodes
                     op_info = OPCODES[opcode]
                     handler = type_f[op_info["type"]]
-                    handler(opcode, op_a, op_b, op_info["code"])
+                    handler(opcode, op_a, op_b,
+                            OPCODE_BYTES[opcode] if binary else op_info["code"])
         else:
             print(f"No match: {input}", file=sys.stderr)
             sys.exit(3)
 
 
+# Instructions after which execution only continues at a label
+NO_FALLTHROUGH = {"HLT", "IRET", "JMP", "RET"}
+
+# Instructions that write the register in their first operand
+WRITES_REG_A = {"ADD", "ADDI", "AND", "DEC", "DIV", "INC", "LD", "LDI", "MOD",
+                "MUL", "NOT", "OR", "POP", "SHL", "SHR", "SUB", "XOR"}
+
+# Registers the optimizer reasons about. IM, IS and SP (R5-R7) also change
+# behind the program's back (interrupts, CALL), so they are left alone.
+OPTIMIZED_REGS = range(5)
+
+
+def split_code(code):
+    """
+    Split pass1's code list into items:
+    ("label", name), ("data", line) or ("insn", opcode, lines).
+    """
+
+    items = []
+    i = 0
+
+    while i < len(code):
+        c = code[i]
+
+        if c[:2] == '# ':
+            items.append(("label", c[2:c.index(" (address")]))
+            i += 1
+            continue
+
+        words = c.split()
+        opcode = words[2] if len(words) > 2 else None
+
+        if opcode in OPCODES and words[0] == OPCODES[opcode]["code"]:
+            length = (int(words[0], 2) >> 6) + 1
+            items.append(("insn", opcode, code[i:i + length]))
+            i += length
+
+        else:
+            # DS and DB bytes
+            items.append(("data", c))
+            i += 1
+
+    return items
+
+
+def join_code(items, sym):
+    """
+    Turn items back into a code list, re-resolving every label's address.
+    """
+
+    code = []
+    addr = 0
+
+    for item in items:
+        if item[0] == "label":
+            sym[item[1]] = addr
+            code.append(f'# {item[1]} (address {addr}):')
+
+        elif item[0] == "data":
+            code.append(item[1])
+            addr += 1
+
+        else:
+            code.extend(item[2])
+            addr += len(item[2])
+
+    return code
+
+
+def insn_reg(item):
+    """Register number of an instruction's first operand."""
+
+    return int(item[2][1], 2)
+
+
+def remove_unreachable(items):
+    """
+    Drop instructions after JMP, HLT, RET or IRET up to the next label.
+    Data is kept: it may be read even though it is never executed.
+    """
+
+    result = []
+    dead = False
+
+    for item in items:
+        if item[0] != "insn":
+            dead = False
+
+        elif dead:
+            continue
+
+        result.append(item)
+
+        if item[0] == "insn" and item[1] in NO_FALLTHROUGH:
+            dead = True
+
+    return result
+
+
+def fold_jumps(items):
+    """
+    `LDI Rx,L1` + `JMP Rx`, where L1 is itself `LDI Rx,L2` + `JMP Rx`, becomes
+    `LDI Rx,L2` + `JMP Rx`: same register value, same destination.
+    """
+
+    def ldi_jmp(i):
+        """(register, label) if items i and i+1 are LDI Rx,label and JMP Rx."""
+
+        if i + 1 >= len(items):
+            return None
+
+        ldi, jmp = items[i], items[i + 1]
+
+        if (ldi[0] == "insn" and ldi[1] == "LDI" and ldi[2][2][:4] == 'sym:' and
+                jmp[0] == "insn" and jmp[1] == "JMP" and
+                insn_reg(ldi) == insn_reg(jmp)):
+            return insn_reg(ldi), ldi[2][2][4:].strip()
+
+        return None
+
+    # Labels whose code is just LDI Rx,label + JMP Rx
+    trampolines = {}
+    labels = []
+
+    for i, item in enumerate(items):
+        if item[0] == "label":
+            labels.append(item[1])
+            continue
+
+        jump = ldi_jmp(i)
+        if jump is not None:
+            for label in labels:
+                trampolines[label] = jump
+
+        labels = []
+
+    result = list(items)
+
+    for i in range(len(items)):
+        jump = ldi_jmp(i)
+
+        if jump is None:
+            continue
+
+        r, label = jump
+        seen = {label}
+
+        while (label in trampolines and trampolines[label][0] == r and
+               trampolines[label][1] not in seen):
+            label = trampolines[label][1]
+            seen.add(label)
+
+        if label != jump[1]:
+            lines = items[i][2]
+            result[i] = ("insn", "LDI",
+                         [f"{OPCODES['LDI']['code']} # LDI R{r},{label}",
+                          lines[1], f"sym:{label}"])
+
+    return result
+
+
+def remove_redundant_loads(items):
+    """
+    Drop LDI of a value the register is known to hold already. Values are
+    only known between labels, as any label may be jumped to.
+    """
+
+    result = []
+    known = {}
+
+    for item in items:
+        if item[0] != "insn":
+            known.clear()
+
+        elif item[1] == "LDI":
+            r = insn_reg(item)
+            value = item[2][2]
+
+            if r in OPTIMIZED_REGS:
+                if known.get(r) == value:
+                    continue
+                known[r] = value
+
+        elif item[1] in WRITES_REG_A:
+            known.pop(insn_reg(item), None)
+
+        elif item[1] in NO_FALLTHROUGH or item[1] in ("CALL", "INT"):
+            # the subroutine or interrupt handler may change any register
+            known.clear()
+
+        result.append(item)
+
+    return result
+
+
+def merge_steps(items):
+    """
+    Merge runs of INC/DEC on one register into a single ADDI (or nothing, if
+    they cancel out). INC and DEC don't touch the flags, so this is safe.
+    """
+
+    result = []
+    i = 0
+
+    while i < len(items):
+        item = items[i]
+
+        if item[0] == "insn" and item[1] in ("INC", "DEC") and insn_reg(item) in OPTIMIZED_REGS:
+            r = insn_reg(item)
+            total = 0
+            j = i
+
+            while (j < len(items) and items[j][0] == "insn" and
+                   items[j][1] in ("INC", "DEC") and insn_reg(items[j]) == r):
+                total += 1 if items[j][1] == "INC" else -1
+                j += 1
+
+            if j - i > 1:
+                total &= 0xff
+
+                if total:
+                    result.append(("insn", "ADDI",
+                                   [f"{OPCODES['ADDI']['code']} # ADDI R{r},{total}",
+                                    p8(r), p8(total)]))
+
+                i = j
+                continue
+
+        result.append(item)
+        i += 1
+
+    return result
+
+
+def optimize(sym, code):
+    """
+    Peephole optimization pass, run between pass1 and pass2
+
+    * Remove unreachable instructions after JMP/HLT/RET/IRET
+    * Fold jump-to-jump chains
+    * Drop LDI of a value the register already holds
+    * Merge repeated INC/DEC into one ADDI
+    * Re-resolve label addresses
+
+    Assumes code is only entered at labels, as it is when jump targets are
+    loaded with LDI Rx,label.
+    """
+
+    items = split_code(code)
+
+    while True:
+        before = items
+        items = remove_unreachable(items)
+        items = fold_jumps(items)
+        items = remove_redundant_loads(items)
+        items = merge_steps(items)
+
+        if items == before:
+            break
+
+    code[:] = join_code(items, sym)
+
+
+def symbol_value(sym, s):
+    """
+    Value of symbol `s` for an LDI operand. Unknown symbols and addresses
+    past the end of memory (which don't fit in the operand byte) are errors.
+    """
+
+    if s not in sym:
+        print(f"unknown symbol: {s}", file=sys.stderr)
+        sys.exit(2)
+
+    if sym[s] > 0xff:
+        print(f"symbol {s} is at address {sym[s]}, past the end of memory",
+              file=sys.stderr)
+        sys.exit(2)
+
+    return sym[s]
+
+
 def pass2(outputfile, sym, code):
     """
     Output the code, substituting in any symbols.
     """
 
     for c in code:
+        # Replace symbols
+        if c[:4] == 'sym:':
+            c = p8(symbol_value(sym, c[4:].strip()))
+
+        outputfile.write(f"{c}\n")
+
+
+def pass2_binary(outputfile, sym, code, header=True):
+    """
+    Output the code as a binary image, substituting in any symbols.
+    With `header` the image carries the entry point, symbol table and checksum.
+    `code` is from pass1 with `binary` set, or text lines (after -O).
+    """
+
+    image = bytearray()
+
+    for c in code:
+        if c.__class__ is int:
+            image.append(c)
+            continue
+
+        # Skip label comments
+        if c[:1] == '#':
+            continue
+
+        # Replace symbols
+        if c[:4] == 'sym:':
+            image.append(symbol_value(sym, c[4:].strip()))
+
+        else:
+            image.append(int(c[:8], 2))
+
+    if header:
+        outputfile.write(IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, 0,
+                                           len(image), zlib.crc32(image),
+                                           len(sym)))
+        outputfile.write(image)
+
+        for name, address in sym.items():
+            name = name.encode("ascii")
+            outputfile.write(bytes([len(name)]) + name + bytes([address]))
+
+    else:
+        outputfile.write(image)
+
+
+class StreamingCode:
+    """
+    Stand-in for the `code` list given to pass1 that writes each line out as
+    soon as it is emitted, so memory stays flat however long the source is.
+
+    References to labels that are already defined are resolved on the spot.
+    Forward references are written as a placeholder and recorded in a fixup
+    table. On a seekable output the placeholders are patched in place by
+    finish(); otherwise output is held in a tail buffer from the first
+    unresolved reference until its label is defined.
+    """
+
+    def __init__(self, outputfile, sym, binary=False):
+        self.outputfile = outputfile
+        self.sym = sym
+        self.binary = binary
+        self.seekable = outputfile.seekable()
+
+        # Seekable output: (file position, symbol) of every placeholder
+        self.fixups = []
+
+        # Unseekable output: output held back while fixups are pending,
+        # as placeholders each followed by a buffer of the output after it.
+        # Entries are numbered from the start of the stream; `flushed` is
+        # the number of the first one still in the tail.
+        self.tail = collections.deque()
+        self.flushed = 0
+
+        # Unseekable output: symbol -> tail entries waiting for it, and a
+        # heap of the numbers of every placeholder put in the tail (resolved
+        # ones are dropped once they reach the top)
+        self.waiting = {}
+        self.pending = []
+        self.resolved = set()
+
+        # Number of code bytes written
+        self.size = 0
+
+    def encode(self, value):
+        if self.binary:
+            return bytes([value])
+
+        return f"{p8(value)}\n"
+
+    def emit(self, data):
+        if self.tail:
+            # Buffered as bytes: an io.StringIO keeps every small write
+            # as a separate string until it is read back
+            self.tail[-1].write(data if self.binary else data.encode())
+        else:
+            self.outputfile.write(data)
+
+    def append(self, c):
+        # Code byte from pass1's binary output
+        if c.__class__ is int:
+            self.size += 1
+            self.emit(bytes((c,)))
+            return
+
+        # Label comment: a pending forward reference may just have been defined
+        if c[:1] == '#':
+            label = c[2:c.index(" (address")]
+
+            if label in self.waiting:
+                self.resolve(label)
+
+            if not self.binary:
+                self.emit(f"{c}\n")
+
+            return
+
+        self.size += 1
+
         # Replace symbols
         if c[:4] == 'sym:':
             s = c[4:].strip()
 
-            if s in sym:
-                c = p8(sym[s])
+            if s in self.sym:
+                self.emit(self.encode(symbol_value(self.sym, s)))
+
+            elif self.seekable:
+                self.fixups.append((self.outputfile.tell(), s))
+                self.outputfile.write(self.encode(0))
 
             else:
-                print(f"unknown symbol: {s}", file=sys.stderr)
-                sys.exit(2)
+                index = self.flushed + len(self.tail)
+                self.waiting.setdefault(s, []).append(index)
+                heapq.heappush(self.pending, index)
+                self.tail.append(self.encode(0))
+                self.tail.append(io.BytesIO())
 
-        outputfile.write(f"{c}\n")
+        else:
+            self.emit(f"{c}\n")
+
+    def resolve(self, label):
+        """Patch the placeholders waiting for `label`, then write out the tail up to the first one still pending."""
+
+        value = self.encode(symbol_value(self.sym, label))
+
+        for index in self.waiting.pop(label):
+            self.tail[index - self.flushed] = value
+            self.resolved.add(index)
+
+        # Only the output before the earliest placeholder still pending can go
+        pending = self.pending
+        while pending and pending[0] in self.resolved:
+            self.resolved.discard(heapq.heappop(pending))
+
+        self.flush_tail(pending[0] if pending else self.flushed + len(self.tail))
+
+    def flush_tail(self, end):
+        """Write out the tail entries before entry number `end`."""
+
+        while self.flushed < end:
+            data = self.tail.popleft()
+            if not isinstance(data, (str, bytes)):
+                data = data.getvalue()
+                if not self.binary:
+                    data = data.decode()
+            self.outputfile.write(data)
+            self.flushed += 1
+
+    def finish(self):
+        """Patch the remaining forward references."""
+
+        if not self.seekable:
+            for s in self.waiting:
+                symbol_value(self.sym, s)
+
+            self.flush_tail(self.flushed + len(self.tail))
+            return
+
+        for position, s in self.fixups:
+            value = symbol_value(self.sym, s)
+            self.outputfile.seek(position)
+            self.outputfile.write(self.encode(value))
+
+        if self.fixups:
+            self.outputfile.seek(0, 2)
+
+        self.fixups = []
+
+
+def assemble_stream(inputfile, outputfile, binary=False, header=False):
+    """
+    Single-pass assembly: pass1 writes straight to `outputfile` through a
+    StreamingCode instead of building the whole `code` list first.
+    A binary image with a header needs a seekable output opened for reading
+    too, as the length and checksum are filled in at the end.
+    """
+
+    sym = {}
+
+    if header:
+        if not outputfile.seekable():
+            print("a .ls8b image cannot be streamed to an unseekable output",
+                  file=sys.stderr)
+            sys.exit(1)
+
+        start = outputfile.tell()
+        outputfile.write(IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, 0, 0, 0, 0))
+
+    code = StreamingCode(outputfile, sym, binary)
+    pass1(inputfile, sym, code, binary)
+    code.finish()
+
+    if header:
+        # Checksum the patched code, reading it back in chunks
+        end = outputfile.tell()
+        outputfile.seek(start + IMAGE_HEADER.size)
+        crc = 0
+        remaining = code.size
+
+        while remaining:
+            chunk = outputfile.read(min(remaining, 65536))
+            crc = zlib.crc32(chunk, crc)
+            remaining -= len(chunk)
+
+        outputfile.seek(start)
+        outputfile.write(IMAGE_HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, 0,
+                                           code.size, crc, len(sym)))
+        outputfile.seek(end)
+
+        for name, address in sym.items():
+            name = name.encode("ascii")
+            outputfile.write(bytes([len(name)]) + name + bytes([address]))
+
+
+class AsmError(Exception):
+    """
+    Raised by assemble() where the command line would print an error and exit.
+    """
+
+
+def assemble(source, optimize_code=False):
+    """
+    Assemble `source` (a string, or any iterable of lines) in memory, with
+    the peephole pass if `optimize_code` is set.
+
+    Returns the program bytes and the symbol table. Nothing is written to
+    files and the output is never formatted as text, so it can go straight
+    into CPU.load_bytes. Errors raise AsmError.
+    """
+
+    if isinstance(source, str):
+        source = source.splitlines()
+
+    sym = {}
+    image = io.BytesIO()
+    errors = io.StringIO()
+
+    try:
+        with contextlib.redirect_stderr(errors):
+            if optimize_code:
+                code = []
+                pass1(source, sym, code)
+                optimize(sym, code)
+                pass2_binary(image, sym, code, header=False)
+
+            else:
+                code = StreamingCode(image, sym, binary=True)
+                pass1(source, sym, code, binary=True)
+                code.finish()
+
+    except SystemExit:
+        raise AsmError(errors.getvalue().strip()) from None
+
+    return image.getvalue(), sym
+
+
+def fingerprint():
+    """
+    Hash of this assembler's own source, used as its version by tools that
+    cache assembled output.
+    """
+
+    with open(__file__, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def close_files(inputfile, outputfile):
+    """
+    Close files opened by open_files, leaving stdin and stdout open.
+    """
+
+    for f in (inputfile, outputfile):
+        if f is not sys.stdin and f is not sys.stdout:
+            f.close()
 
 
 def main(argv):
     # Parse command line
-    inputfile, outputfile = parse_commandline(argv)
+    inputfile, outputfile, stream, optimize_code = parse_commandline(argv)
 
     # Open files
     inputfile, outputfile = open_files(inputfile, outputfile)
 
-    # Set up the symbol table
-    sym = {}
+    try:
+        if stream:
+            assemble_stream(inputfile, outputfile,
+                            binary=outputfile.name.endswith(BINARY_EXTENSIONS),
+                            header=outputfile.name.endswith(".ls8b"))
+            return 0
 
-    # Set up the machine code output
-    code = []
+        # Set up the symbol table
+        sym = {}
+
+        # Set up the machine code output
+        code = []
+
+        # Assemble (binary images skip the text encoding, unless -O needs it)
+        binary = outputfile.name.endswith(BINARY_EXTENSIONS) and not optimize_code
+        pass1(inputfile, sym, code, binary)
+
+        if optimize_code:
+            optimize(sym, code)
+
+        if outputfile.name.endswith(".ls8b"):
+            pass2_binary(outputfile, sym, code)
+        elif outputfile.name.endswith(".bin"):
+            pass2_binary(outputfile, sym, code, header=False)
+        else:
+            pass2(outputfile, sym, code)
 
-    # Assemble
-    pass1(inputfile, sym, code)
-    pass2(outputfile, sym, code)
+    finally:
+        close_files(inputfile, outputfile)
 
     return 0
 
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# Build driver for LS-8 assembly sources
+#
+# Assembles every source in-process with asm.py's main, across a pool of
+# worker processes. A source is skipped when its hash and the assembler's
+# fingerprint match the cached build and the output is still there, so a
+# rebuild costs time only for the files that changed.
+#
+# Usage: build.py [-j jobs] [-o outdir] [--force] [infile.asm ...]
+#
+# With no sources, every .asm file in the current directory is built. The
+# output directory defaults to ../ls8/examples, as with buildall.
+
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import asm
+
+# Build cache, kept in the output directory
+CACHE_NAME = ".asm-build-cache.json"
+
+
+def file_hash(filename):
+    with open(filename, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def load_cache(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(filename, cache):
+    # Write then rename, so an interrupted build cannot leave a corrupt cache
+    with open(filename + ".tmp", "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(filename + ".tmp", filename)
+
+
+def assemble(inputfile, outputfile):
+    """
+    Assemble one file in this process. Returns the exit status; asm.py reports
+    errors on stderr and exits, which is caught here.
+    """
+
+    try:
+        return asm.main(["asm.py", inputfile, outputfile])
+
+    except SystemExit as e:
+        # Don't leave a half-written output behind
+        if os.path.exists(outputfile):
+            os.remove(outputfile)
+
+        return e.code if isinstance(e.code, int) else 1
+
+
+def up_to_date(entry, source, assembler, outputfile):
+    return (entry is not None and
+            entry["source"] == source and
+            entry["assembler"] == assembler and
+            os.path.exists(outputfile) and
+            file_hash(outputfile) == entry["output"])
+
+
+def build(sources, outdir, jobs=None, force=False):
+    """
+    Build `sources` into `outdir`. Returns (built, skipped, failed) lists of
+    source names.
+    """
+
+    cachefile = os.path.join(outdir, CACHE_NAME)
+    cache = load_cache(cachefile)
+    assembler = asm.fingerprint()
+
+    work = {}
+    skipped = []
+
+    for inputfile in sources:
+        outputfile = os.path.join(outdir, os.path.splitext(os.path.basename(inputfile))[0] + ".ls8")
+        source = file_hash(inputfile)
+
+        if not force and up_to_date(cache.get(outputfile), source, assembler, outputfile):
+            skipped.append(inputfile)
+        else:
+            work[inputfile] = (outputfile, source)
+
+    built = []
+    failed = []
+
+    if work:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {inputfile: pool.submit(assemble, inputfile, outputfile)
+                       for inputfile, (outputfile, _) in work.items()}
+
+            for inputfile, future in futures.items():
+                outputfile, source = work[inputfile]
+
+                if future.result() == 0:
+                    built.append(inputfile)
+                    cache[outputfile] = {
+                        "source": source,
+                        "assembler": assembler,
+                        "output": file_hash(outputfile),
+                    }
+                else:
+                    failed.append(inputfile)
+                    cache.pop(outputfile, None)
+
+        save_cache(cachefile, cache)
+
+    return built, skipped, failed
+
+
+def main(argv):
+    args = argv[1:]
+    jobs = None
+    outdir = os.path.join("..", "ls8", "examples")
+    force = False
+    sources = []
+
+    while args:
+        arg = args.pop(0)
+
+        if arg == "-j":
+            jobs = int(args.pop(0))
+        elif arg == "-o":
+            outdir = args.pop(0)
+        elif arg == "--force":
+            force = True
+        else:
+            sources.append(arg)
+
+    if not sources:
+        sources = sorted(f for f in os.listdir(".") if f.endswith(".asm"))
+
+    os.makedirs(outdir, exist_ok=True)
+
+    built, skipped, failed = build(sources, outdir, jobs, force)
+
+    for inputfile in failed:
+        print(f"failed: {inputfile}", file=sys.stderr)
+
+    print(f"{len(built)} built, {len(skipped)} up to date, {len(failed)} failed",
+          file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
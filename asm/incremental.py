@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+# Incremental assembler for LS-8
+#
+# Keeps a persistent cache of parsed and encoded lines keyed by a hash of
+# their content. On re-assembly only the lines that changed are parsed, and
+# only the symbol fixups affected by the change are resolved again.
+#
+# Usage: incremental.py infile.asm [outfile.ls8] [--cache cachefile]
+#
+# The cache defaults to infile.asm.cache.
+
+import hashlib
+import pickle
+import sys
+
+import asm
+
+
+class Line:
+    """One source line: its cached encoding plus where it landed in this build."""
+
+    def __init__(self, key, label, items):
+        self.key = key
+        # Label defined on this line, if any
+        self.label = label
+        # pass1 output for the line, with "sym:NAME" placeholders
+        self.items = items
+        # Same, with the placeholders resolved
+        self.resolved = items
+        # Labels this line refers to
+        self.refs = {c[4:].strip() for c in items if c[:4] == 'sym:'}
+        self.size = len(items)
+        self.addr = 0
+
+
+class IncrementalAssembler:
+    def __init__(self):
+        # content hash -> (label, items)
+        self.cache = {}
+        # Lines of the last build, in order
+        self.lines = []
+        # Symbol table of the last build
+        self.sym = {}
+        # label -> lines that refer to it
+        self.users = {}
+        # Statistics for the last build
+        self.parsed = 0
+        self.reresolved = 0
+
+    def encode(self, text):
+        """Parse and encode a single line with pass1, using the cache."""
+        key = hashlib.sha1(text.encode()).digest()
+
+        if key not in self.cache:
+            sym = {}
+            code = []
+            asm.pass1([text], sym, code)
+            # pass1 emits a "# LABEL (address N):" comment; addresses are
+            # only known at layout time, so it is written by output()
+            items = [c for c in code if c[:1] != '#']
+            self.cache[key] = (next(iter(sym), None), items)
+            self.parsed += 1
+
+        label, items = self.cache[key]
+        return Line(key, label, items)
+
+    def resolve(self, line):
+        """Substitute symbol addresses into a line's code."""
+        if not line.refs:
+            return
+
+        resolved = []
+
+        for c in line.items:
+            if c[:4] == 'sym:':
+                c = asm.p8(asm.symbol_value(self.sym, c[4:].strip()))
+
+            resolved.append(c)
+
+        line.resolved = resolved
+        self.reresolved += 1
+
+    def assemble(self, texts):
+        """
+        Assemble the source lines in `texts`, reusing the previous build for
+        the unchanged lines before and after the edited region.
+        """
+        self.parsed = 0
+        self.reresolved = 0
+
+        old = self.lines
+        keys = [hashlib.sha1(text.encode()).digest() for text in texts]
+
+        # Unchanged prefix and suffix
+        prefix = 0
+        limit = min(len(old), len(keys))
+        while prefix < limit and old[prefix].key == keys[prefix]:
+            prefix += 1
+
+        suffix = 0
+        while (suffix < limit - prefix and
+               old[len(old) - 1 - suffix].key == keys[len(keys) - 1 - suffix]):
+            suffix += 1
+
+        removed = old[prefix:len(old) - suffix]
+        added = [self.encode(text) for text in texts[prefix:len(texts) - suffix]]
+        kept = old[len(old) - suffix:]
+
+        # Labels whose address changed or vanished; their users need resolving
+        moved = set()
+
+        for line in removed:
+            if line.label is not None and self.sym.get(line.label) == line.addr:
+                del self.sym[line.label]
+                moved.add(line.label)
+            for label in line.refs:
+                self.users.get(label, set()).discard(line)
+
+        addr = old[prefix - 1].addr + old[prefix - 1].size if prefix else 0
+        old_end = addr + sum(line.size for line in removed)
+
+        for line in added:
+            line.addr = addr
+            addr += line.size
+            if line.label is not None:
+                self.sym[line.label] = line.addr
+                moved.add(line.label)
+            for label in line.refs:
+                self.users.setdefault(label, set()).add(line)
+
+        # Everything after the edit shifts by the change in size
+        delta = addr - old_end
+        if delta:
+            for line in kept:
+                line.addr += delta
+                if line.label is not None:
+                    self.sym[line.label] = line.addr
+                    moved.add(line.label)
+
+        self.lines = old[:prefix] + added + kept
+
+        # Re-resolve only the fixups that can have changed
+        dirty = set(added)
+        for label in moved:
+            dirty.update(self.users.get(label, ()))
+        for line in dirty:
+            self.resolve(line)
+
+    def output(self, outputfile):
+        """Write the build in the same format as asm.py's pass2."""
+        for line in self.lines:
+            if line.label is not None:
+                outputfile.write(f"# {line.label} (address {line.addr}):\n")
+            for c in line.resolved:
+                outputfile.write(f"{c}\n")
+
+
+def load_cache(filename):
+    """Load a saved assembler, or start a fresh one if there is none or it is stale."""
+    try:
+        with open(filename, "rb") as f:
+            version, assembler = pickle.load(f)
+        if version == asm.fingerprint():
+            return assembler
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        pass
+    return IncrementalAssembler()
+
+
+def save_cache(filename, assembler):
+    with open(filename, "wb") as f:
+        pickle.dump((asm.fingerprint(), assembler), f)
+
+
+def main(argv):
+    args = argv[1:]
+    cachefile = None
+
+    if "--cache" in args:
+        index = args.index("--cache")
+        cachefile = args[index + 1]
+        del args[index:index + 2]
+
+    if len(args) not in (1, 2):
+        print("usage: incremental.py infile.asm [outfile.ls8] [--cache cachefile]",
+              file=sys.stderr)
+        return 1
+
+    inputfile = args[0]
+    if cachefile is None:
+        cachefile = inputfile + ".cache"
+
+    with open(inputfile) as f:
+        texts = f.read().splitlines()
+
+    assembler = load_cache(cachefile)
+    assembler.assemble(texts)
+
+    if len(args) == 2:
+        with open(args[1], "w") as outputfile:
+            assembler.output(outputfile)
+    else:
+        assembler.output(sys.stdout)
+
+    save_cache(cachefile, assembler)
+
+    print(f"{assembler.parsed} lines parsed, {assembler.reresolved} fixups resolved",
+          file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+
+"""
+Static analysis of LS-8 programs: control-flow graph, call graph and reachable code.
+
+    python analysis.py program.ls8 [--dot graph.dot]
+
+Works on a loaded CPU's RAM (Analysis.of(cpu)) or on anything CPU.load
+accepts, including asm.py output.
+"""
+
+import sys
+
+NAMES = {
+    0b00000000: "NOP",  0b00000001: "HLT",  0b00010001: "RET",  0b00010011: "IRET",
+    0b01000101: "PUSH", 0b01000110: "POP",  0b01000111: "PRN",  0b01001000: "PRA",
+    0b01010000: "CALL", 0b01010010: "INT",  0b01010100: "JMP",  0b01010101: "JEQ",
+    0b01010110: "JNE",  0b01100101: "INC",  0b01100110: "DEC",  0b01101001: "NOT",
+    0b10000010: "LDI",  0b10000011: "LD",   0b10000100: "ST",   0b10000110: "ADDI",
+    0b10100000: "ADD",  0b10100001: "SUB",  0b10100010: "MUL",  0b10100011: "DIV",
+    0b10100100: "MOD",  0b10100111: "CMP",  0b10101000: "AND",  0b10101010: "OR",
+    0b10101011: "XOR",  0b10101100: "SHL",  0b10101101: "SHR",
+}
+OPCODES = {name: opcode for opcode, name in NAMES.items()}
+
+# Register-to-register operations that can be folded when both values are known
+FOLD = {
+    "ADD": lambda a, b: a + b,
+    "SUB": lambda a, b: a - b,
+    "MUL": lambda a, b: a * b,
+    "AND": lambda a, b: a & b,
+    "OR":  lambda a, b: a | b,
+    "XOR": lambda a, b: a ^ b,
+    "SHL": lambda a, b: a << b,
+    "SHR": lambda a, b: a >> b,
+}
+
+# Instructions that write the register in their first operand
+WRITES_REG_A = {"ADD", "ADDI", "AND", "DEC", "DIV", "INC", "LD", "LDI", "MOD",
+                "MUL", "NOT", "OR", "POP", "SHL", "SHR", "SUB", "XOR"}
+
+# Instructions that end a basic block
+BLOCK_END = {"HLT", "RET", "IRET", "JMP", "JEQ", "JNE", "CALL", "INT"}
+
+SP = 7
+INT_VECTORS = 0xF8
+# Bytes an interrupt pushes: PC, FL and R0-R6
+INTERRUPT_FRAME = 9
+# Registers at power on (R0-R6 cleared, SP at 0xF3)
+POWER_ON = (0, 0, 0, 0, 0, 0, 0, 0xF3)
+UNKNOWN = (None,) * 8
+
+
+class Block:
+    """A basic block: straight-line instructions with one entry and one exit."""
+
+    def __init__(self, start):
+        self.start = start
+        # (pc, name, operand_a, operand_b, length)
+        self.instructions = []
+        # start addresses of the blocks control can go to next
+        self.successors = set()
+        # entry addresses of subroutines called from this block
+        self.calls = set()
+        # set when a jump target could not be worked out
+        self.unresolved = False
+
+    @property
+    def end(self):
+        """Address just past the block's last instruction."""
+        pc, _, _, _, length = self.instructions[-1]
+        return pc + length
+
+
+class Analysis:
+    """
+    Abstract interpretation of a RAM image from its entry point.
+
+    Register values loaded with LDI (and simple arithmetic on them) are
+    propagated through the program, which resolves the targets of
+    JMP/JEQ/JNE/CALL register operands, ST addresses and interrupt vectors.
+    The result:
+
+    * `reachable`: addresses of every instruction that can run
+    * `blocks`: basic blocks by start address, with successor edges
+    * `functions` and `callgraph`: subroutine entries (main, CALL targets and
+      interrupt handlers) and which ones call which
+    * `code`: bytes covered by reachable instructions
+    * `writes` and `unknownWrites`: ST and stack writes with a known address,
+      and the PCs of writes whose address could not be worked out
+    """
+
+    def __init__(self, ram, entry=0, symbols=None):
+        self.ram = bytes(ram)
+        self.entry = entry
+        self.symbols = symbols or {}
+        # function entry -> registers a call to it may change; starts empty and
+        # grows until the analysis agrees with it
+        self.clobbers = {}
+        while True:
+            self.interpret()
+            self.build()
+            clobbers = self.find_clobbers()
+            if clobbers == self.clobbers:
+                break
+            self.clobbers = clobbers
+
+    @classmethod
+    def of(cls, cpu):
+        """Analyze the program loaded in `cpu`, starting at its PC."""
+        return cls(cpu.ram, cpu.pc, cpu.symbols)
+
+    def interpret(self):
+        """Propagate register values to a fixed point over every reachable path."""
+        ram = self.ram
+        # pc -> known register values at that instruction (None = unknown)
+        self.states = {}
+        # pc -> (name, operand_a, operand_b, length)
+        self.instructions = {}
+        self.leaders = {self.entry}
+        self.functions = {self.entry}
+        self.handlers = set()
+        self.writes = set()
+        self.unknownWrites = set()
+        # lowest address the stack reaches, when every push has a known SP
+        self.stackLow = POWER_ON[SP]
+        self.invalid = set()
+        # PCs of jumps and calls whose target register isn't known
+        self.unresolved = set()
+        work = [(self.entry, POWER_ON)]
+
+        # handlers already in the vector table
+        for number in range(8):
+            vector = ram[INT_VECTORS + number]
+            if vector:
+                self.add_handler(vector, work)
+
+        while work:
+            pc, regs = work.pop()
+            old = self.states.get(pc)
+            if old is not None:
+                merged = tuple(a if a == b else None for a, b in zip(old, regs))
+                if merged == old:
+                    continue
+                regs = merged
+            self.states[pc] = regs
+
+            opcode = ram[pc]
+            name = NAMES.get(opcode)
+            if name is None:
+                self.invalid.add(pc)
+                continue
+            length = (opcode >> 6) + 1
+            a = ram[(pc + 1) & 0xFF]
+            b = ram[(pc + 2) & 0xFF]
+            self.instructions[pc] = (name, a, b, length)
+            if length > 1 and a > 7 or length > 2 and name != "LDI" and name != "ADDI" and b > 7:
+                self.invalid.add(pc)
+                continue
+
+            after = list(regs)
+            nextPc = (pc + length) & 0xFF
+
+            if name == "LDI":
+                after[a] = b
+            elif name == "ADDI":
+                after[a] = None if regs[a] is None else (regs[a] + b) & 0xFF
+            elif name == "INC" or name == "DEC":
+                after[a] = None if regs[a] is None else (regs[a] + (1 if name == "INC" else -1)) & 0xFF
+            elif name == "NOT":
+                after[a] = None if regs[a] is None else ~regs[a] & 0xFF
+            elif name in FOLD:
+                known = regs[a] is not None and regs[b] is not None
+                after[a] = FOLD[name](regs[a], regs[b]) & 0xFF if known else None
+            elif name == "PUSH":
+                self.push(pc, regs, after, 1)
+            elif name == "POP":
+                after[SP] = None if regs[SP] is None else (regs[SP] + 1) & 0xFF
+                after[a] = None
+            elif name == "ST":
+                self.store(pc, regs[a], regs[b], work)
+            elif name in WRITES_REG_A:
+                after[a] = None
+
+            if name in ("JMP", "JEQ", "JNE"):
+                target = regs[a]
+                if target is None:
+                    self.unresolved.add(pc)
+                else:
+                    self.leaders.add(target)
+                    work.append((target, tuple(after)))
+                if name != "JMP":
+                    self.leaders.add(nextPc)
+                    work.append((nextPc, tuple(after)))
+            elif name == "CALL":
+                target = regs[a]
+                self.push(pc, regs, after, 1)
+                if target is None:
+                    self.unresolved.add(pc)
+                else:
+                    self.leaders.add(target)
+                    self.functions.add(target)
+                    work.append((target, tuple(after)))
+                # the subroutine returns with SP balanced, other registers may change
+                changed = self.clobbers.get(target, range(SP)) if target is not None else range(SP)
+                returned = list(regs)
+                for r in changed:
+                    returned[r] = None
+                self.leaders.add(nextPc)
+                work.append((nextPc, tuple(returned)))
+            elif name == "INT":
+                self.leaders.add(nextPc)
+                work.append((nextPc, tuple(after)))
+            elif name not in ("HLT", "RET", "IRET"):
+                work.append((nextPc, tuple(after)))
+
+        if self.handlers and self.stackLow is not None:
+            # an interrupt can push its frame below any point the stack reached
+            self.stackLow -= INTERRUPT_FRAME
+
+    def push(self, pc, regs, after, count):
+        """Account for a stack write by the instruction at `pc`."""
+        if regs[SP] is None:
+            self.unknownWrites.add(pc)
+            self.stackLow = None
+            after[SP] = None
+            return
+        sp = (regs[SP] - count) & 0xFF
+        after[SP] = sp
+        self.writes.add(sp)
+        if self.stackLow is not None:
+            self.stackLow = min(self.stackLow, sp)
+
+    def store(self, pc, address, value, work):
+        """Account for an ST; a known write to the vector table adds a handler."""
+        if address is None:
+            self.unknownWrites.add(pc)
+            return
+        self.writes.add(address)
+        if INT_VECTORS <= address <= 0xFF:
+            if value is None:
+                self.unknownWrites.add(pc)
+            else:
+                self.add_handler(value, work)
+
+    def add_handler(self, address, work):
+        if address not in self.handlers:
+            self.handlers.add(address)
+            self.functions.add(address)
+            self.leaders.add(address)
+            work.append((address, UNKNOWN))
+
+    def build(self):
+        """Split the reachable instructions into basic blocks and the call graph."""
+        self.reachable = set(self.instructions)
+        self.code = set()
+        for pc, (_, _, _, length) in self.instructions.items():
+            self.code.update((pc + i) & 0xFF for i in range(length))
+
+        self.blocks = {}
+        for leader in sorted(self.leaders):
+            if leader not in self.instructions:
+                continue
+            block = Block(leader)
+            pc = leader
+            while True:
+                name, a, b, length = self.instructions[pc]
+                block.instructions.append((pc, name, a, b, length))
+                nextPc = (pc + length) & 0xFF
+                if pc in self.unresolved:
+                    block.unresolved = True
+                if name in BLOCK_END or nextPc in self.leaders or nextPc not in self.instructions:
+                    break
+                pc = nextPc
+            self.blocks[leader] = block
+
+        for block in self.blocks.values():
+            pc, name, a, b, length = block.instructions[-1]
+            regs = self.states[pc]
+            nextPc = (pc + length) & 0xFF
+            if name in ("JMP", "JEQ", "JNE") and regs[a] is not None:
+                block.successors.add(regs[a])
+            if name in ("JEQ", "JNE", "CALL", "INT") or name not in BLOCK_END:
+                if nextPc in self.instructions:
+                    block.successors.add(nextPc)
+            if name == "CALL" and regs[a] is not None:
+                block.calls.add(regs[a])
+
+        # function -> blocks reachable from its entry without following calls
+        self.members = {}
+        for function in self.functions:
+            seen = set()
+            stack = [function]
+            while stack:
+                start = stack.pop()
+                if start in seen or start not in self.blocks:
+                    continue
+                seen.add(start)
+                stack.extend(self.blocks[start].successors)
+            self.members[function] = seen
+
+        self.callgraph = {function: set() for function in self.functions}
+        for function, members in self.members.items():
+            for start in members:
+                self.callgraph[function].update(self.blocks[start].calls)
+
+    def find_clobbers(self):
+        """Registers (other than SP) each function, or anything it calls, may change."""
+        clobbers = {}
+        for function, members in self.members.items():
+            changed = set(self.clobbers.get(function, ()))
+            for start in members:
+                block = self.blocks[start]
+                for pc, name, a, b, length in block.instructions:
+                    if name in WRITES_REG_A:
+                        changed.add(a)
+                if block.unresolved and block.instructions[-1][1] == "CALL":
+                    changed.update(range(SP))
+            changed.discard(SP)
+            clobbers[function] = changed
+
+        # callees' changes count for their callers too
+        growing = True
+        while growing:
+            growing = False
+            for function, callees in self.callgraph.items():
+                for callee in callees:
+                    if not clobbers[callee] <= clobbers[function]:
+                        clobbers[function] |= clobbers[callee]
+                        growing = True
+        return clobbers
+
+    def is_static(self, start=None, end=None):
+        """
+        True if nothing the program runs can write to addresses start..end-1
+        (by default, the reachable code): no ST or stack write lands there,
+        and every write's address is known.
+
+        Always False while a jump or call target is unresolved: code reached
+        only through it was never interpreted, so its writes are unknown.
+        """
+        if self.unresolved or self.unknownWrites or self.stackLow is None:
+            return False
+        region = self.code if start is None else set(range(start, end))
+        if region & self.writes:
+            return False
+        # the stack grows down from 0xF3 to stackLow
+        return not any(self.stackLow <= address < POWER_ON[SP] for address in region)
+
+    def name(self, address):
+        for label, value in self.symbols.items():
+            if value == address:
+                return label
+        return "main" if address == self.entry else f"sub_{address:02X}"
+
+    def disassemble(self, pc, name, a, b, length):
+        if name == "LDI" or name == "ADDI":
+            return f"{name} R{a},{b:02X}"
+        if length == 2:
+            return f"{name} R{a}"
+        if length == 3:
+            return f"{name} R{a},R{b}"
+        return name
+
+    def dot(self):
+        """Graphviz DOT source: basic blocks, clustered by function, with flow and call edges."""
+        lines = ["digraph ls8 {", '  node [shape=box fontname="monospace"];']
+        for function in sorted(self.functions):
+            lines.append(f"  subgraph cluster_{function:02X} {{")
+            lines.append(f'    label="{self.name(function)}";')
+            for start in sorted(self.members[function]):
+                block = self.blocks[start]
+                text = "\\l".join(f"{pc:02X}: {self.disassemble(pc, *rest)}"
+                                  for pc, *rest in block.instructions)
+                color = ' color="red"' if block.unresolved else ""
+                lines.append(f'    b{start:02X} [label="{text}\\l"{color}];')
+            lines.append("  }")
+        for start, block in sorted(self.blocks.items()):
+            for successor in sorted(block.successors):
+                lines.append(f"  b{start:02X} -> b{successor:02X};")
+            for callee in sorted(block.calls):
+                lines.append(f"  b{start:02X} -> b{callee:02X} [style=dashed];")
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        """Short text summary."""
+        lines = [
+            f"{len(self.reachable)} reachable instructions in {len(self.blocks)} blocks, "
+            f"{len(self.code)} code bytes",
+            f"functions: " + ", ".join(self.name(f) for f in sorted(self.functions)),
+        ]
+        for function in sorted(self.functions):
+            callees = ", ".join(self.name(c) for c in sorted(self.callgraph[function]))
+            if callees:
+                lines.append(f"  {self.name(function)} calls {callees}")
+        unresolved = [b.start for b in self.blocks.values() if b.unresolved]
+        if unresolved:
+            lines.append("unresolved jumps in blocks " + ", ".join(f"{s:02X}" for s in unresolved))
+        if self.invalid:
+            lines.append("invalid instructions at " + ", ".join(f"{pc:02X}" for pc in sorted(self.invalid)))
+        if self.is_static():
+            lines.append("code is provably not self-modifying")
+        elif self.unresolved:
+            lines.append("code is possibly self-modifying (unresolved jumps may reach unanalyzed code)")
+        else:
+            lines.append("code is possibly self-modifying")
+        return "\n".join(lines) + "\n"
+
+
+def main(argv):
+    from cpu import CPU
+
+    args = argv[1:]
+    dot = None
+    if "--dot" in args:
+        index = args.index("--dot")
+        dot = args[index + 1]
+        del args[index:index + 2]
+
+    if len(args) != 1:
+        print("usage: analysis.py program [--dot graph.dot]")
+        return 1
+
+    cpu = CPU()
+    cpu.load(args[0])
+    analysis = Analysis.of(cpu)
+    print(analysis.report(), end="")
+    if dot is not None:
+        with open(dot, "w") as file:
+            file.write(analysis.dot())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,430 @@
+"""Lockstep batch engine: runs the same LS-8 program on many machines at once."""
+
+import numpy as np
+
+IM = 5
+IS = 6
+SP = 7
+
+# Top of an empty stack, as in the interpreter
+STACK_TOP = 0xF3
+# Interrupt n's handler address is stored at INT_VECTORS + n
+INT_VECTORS = 0xF8
+# The interpreter's timer raises I0 once per emulated second
+TIMER_INTERVAL = 1_000_000
+# Interrupt number for each nonzero IS & IM mask: its lowest set bit
+LOWEST_BIT = np.array([(mask & -mask).bit_length() - 1 if mask else 0 for mask in range(256)],
+                      dtype=np.uint8)
+# Stands in for "every machine" in a lockstep step, so registers are read as column views
+EVERY = slice(None)
+
+# Opcodes whose second operand is an immediate value rather than a register
+IMMEDIATE = {0b10000010, 0b10000110}  # LDI, ADDI
+# Conditional jumps only read their register when taken (see jump_if)
+CONDITIONAL = {0b01010101, 0b01010110}  # JEQ, JNE
+
+
+class BatchCPU:
+    """
+    N LS-8 machines whose state lives in NumPy arrays:
+        reg  N x 8   uint8 registers
+        ram  N x 256 uint8 memory
+        pc   N       uint8 program counters
+        fl   N       uint8 flags (00000LGE)
+
+    Every `step()` executes one instruction on every running machine. While
+    every machine is at the same instruction, its operands are plain numbers
+    and each register it touches is a single column of `reg`. Otherwise
+    machines are grouped by the opcode at their PC, and each group is run
+    with operand arrays.
+
+    Each machine counts its own cycles, and interrupts work as in the
+    interpreter: the timer raises I0 every emulated second (a machine jumping
+    to itself skips ahead to the next tick), INT raises the others, and a
+    pending interrupt that IM enables is serviced before the next instruction.
+
+    A machine fails (stops, with `failed` set) wherever the interpreter would
+    raise or halt with an error: an unsupported opcode, a register operand
+    above R7, a pop from an empty stack, or a division by zero.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.reg = np.zeros((count, 8), dtype=np.uint8)
+        self.reg[:, SP] = STACK_TOP
+        self.ram = np.zeros((count, 256), dtype=np.uint8)
+        self.pc = np.zeros(count, dtype=np.uint8)
+        self.fl = np.zeros(count, dtype=np.uint8)
+        self.running = np.zeros(count, dtype=bool)
+        self.canInterrupt = np.ones(count, dtype=bool)
+        # Machines stopped by an error (see above)
+        self.failed = np.zeros(count, dtype=bool)
+        # PRN/PRA output, one list of strings per machine
+        self.output = [[] for _ in range(count)]
+        # Total instructions executed across the batch
+        self.instructions = 0
+        # Cycles per machine, and the cycle of each machine's next timer tick
+        self.cycles = np.zeros(count, dtype=np.int64)
+        self.ticks = np.full(count, TIMER_INTERVAL, dtype=np.int64)
+        # Steps taken; no tick is due before step `deadline`, so most steps
+        # skip the timer with one comparison
+        self.steps = 0
+        self.deadline = TIMER_INTERVAL
+        # False while no running machine can have a bit set in IS
+        self.pending = False
+        # Row numbers for EVERY, where an index array is needed
+        self.everyone = np.arange(count)
+
+        self.branchtable = {
+            0b00000000: self.NOP,
+            0b00000001: self.HLT,
+            0b10000010: self.LDI,
+            0b10000110: self.ADDI,
+            0b10000011: self.LD,
+            0b10000100: self.ST,
+            0b01000111: self.PRN,
+            0b01001000: self.PRA,
+            0b01000101: self.PUSH,
+            0b01000110: self.POP,
+            0b01010000: self.CALL,
+            0b00010001: self.RET,
+            0b01010010: self.INT,
+            0b00010011: self.IRET,
+            0b01010100: self.JMP,
+            0b01010101: self.JEQ,
+            0b01010110: self.JNE,
+            0b01100101: self.ALU_INC,
+            0b01100110: self.ALU_DEC,
+            0b01101001: self.ALU_NOT,
+            0b10100111: self.ALU_CMP,
+            0b10100011: self.ALU_DIV,
+            0b10100100: self.ALU_MOD,
+            0b10101100: self.ALU_SHL,
+            0b10101101: self.ALU_SHR,
+        }
+        # ALU operations that map straight onto a uint8 ufunc (wrapping at 8 bits)
+        for opcode, ufunc in (
+            (0b10100000, np.add),
+            (0b10100001, np.subtract),
+            (0b10100010, np.multiply),
+            (0b10101000, np.bitwise_and),
+            (0b10101010, np.bitwise_or),
+            (0b10101011, np.bitwise_xor),
+        ):
+            self.branchtable[opcode] = self.binary(ufunc)
+
+    def load(self, program, address=0):
+        """
+        Copy the same program bytes into every machine's RAM and start them all.
+        Per-machine inputs can then be written straight into `reg` and `ram`.
+        """
+        data = np.frombuffer(bytes(program), dtype=np.uint8)
+        self.ram[:, address:address + len(data)] = data
+        self.running[:] = True
+        # inputs may set IS
+        self.pending = True
+
+    def step(self):
+        """
+        Execute one instruction on every running machine.
+        Returns False once every machine has halted.
+        """
+        if self.steps >= self.deadline:
+            self.timer()
+        if self.pending:
+            self.pending = self.interrupt()
+
+        running = self.running
+        ram = self.ram
+        if running.all():
+            m = EVERY
+            size = self.count
+            pc = self.pc
+            first = int(pc[0])
+            if first < 254 and (pc == first).all():
+                window = ram[:, first:first + 3]
+                if (window == window[0]).all():
+                    # lockstep: one instruction, with the same operands, everywhere
+                    op, a, b = window[0].tolist()
+                    self.dispatch(op, m, a, b)
+                    self.finish(m, size)
+                    return True
+        else:
+            m = np.flatnonzero(running)
+            size = m.size
+            if size == 0:
+                return False
+            pc = self.pc[m]
+
+        rows = self.indices(m)
+        ops = ram[rows, pc]
+        a = ram[rows, pc + np.uint8(1)]
+        b = ram[rows, pc + np.uint8(2)]
+
+        if (ops == ops[0]).all():
+            self.dispatch(int(ops[0]), rows, a, b)
+        else:
+            for op in np.unique(ops):
+                group = ops == op
+                self.dispatch(int(op), rows[group], a[group], b[group])
+
+        self.finish(m, size)
+        return True
+
+    def finish(self, m, size):
+        """Count the instruction just run on machines `m`."""
+        self.cycles[m] += 1
+        self.steps += 1
+        self.instructions += size
+
+    def run(self, max_steps=None):
+        """Step until every machine halts (or `max_steps` steps). Returns the number of steps."""
+        steps = 0
+        while (max_steps is None or steps < max_steps) and self.step():
+            steps += 1
+        return steps
+
+    def dispatch(self, op, m, a, b):
+        """
+        Run opcode `op` on machines `m` with operands `a` and `b`: either index
+        arrays, or EVERY with plain numbers (see step).
+        """
+        handler = self.branchtable.get(op)
+        if handler is None:
+            self.fail(m)
+            return
+        registers = 0 if op in CONDITIONAL else 1 if op in IMMEDIATE else op >> 6
+        if registers:
+            # the interpreter raises IndexError on a register number above 7
+            if m is EVERY:
+                if a > 7 or registers == 2 and b > 7:
+                    self.fail(m)
+                    return
+            else:
+                bad = a > 7
+                if registers == 2:
+                    bad |= b > 7
+                if bad.any():
+                    self.fail(m[bad])
+                    ok = ~bad
+                    m, a, b = m[ok], a[ok], b[ok]
+            if np.any(a == IS):
+                # may have set an interrupt bit
+                self.pending = True
+        handler(m, a, b)
+
+    def indices(self, m):
+        """Machine numbers for `m`, for indexing by per-machine values (e.g. RAM addresses)."""
+        return self.everyone if m is EVERY else m
+
+    def expand(self, m, a):
+        """`m` and `a` as arrays, so a lockstep step can treat machines differently."""
+        if m is EVERY:
+            return self.everyone, np.full(self.count, a, dtype=np.uint8)
+        return m, a
+
+    def fail(self, m):
+        self.failed[m] = True
+        self.running[m] = False
+
+    def advance(self, m, length):
+        self.pc[m] += np.uint8(length)
+
+    def push(self, m, value):
+        """Push `value` onto the stack of machines `m` (an index array)."""
+        self.reg[m, SP] -= np.uint8(1)
+        self.ram[m, self.reg[m, SP]] = value
+
+    def pop(self, m):
+        """Pop the top of the stack of machines `m` (an index array), like CPU.popValue."""
+        sp = self.reg[m, SP]
+        self.reg[m, SP] = sp + np.uint8(1)
+        return self.ram[m, sp]
+
+    def jump(self, m, target):
+        """Set the PC of machines `m` to `target`, skipping ahead as CPU.spin does for a jump to itself."""
+        spin = target == self.pc[m]
+        if spin.any():
+            rows = self.indices(m)[spin]
+            # the scheduler moves an idle CPU on to its next tick, after this instruction counts
+            self.cycles[rows] = np.maximum(self.cycles[rows] + 1, self.ticks[rows]) - 1
+            self.deadline = 0
+        self.pc[m] = target
+
+    def timer(self):
+        """Raise I0 on every running machine whose timer tick is due."""
+        running = self.running
+        due = running & (self.cycles >= self.ticks)
+        while due.any():
+            self.reg[due, IS] |= np.uint8(1)
+            self.ticks[due] += TIMER_INTERVAL
+            self.pending = True
+            due = running & (self.cycles >= self.ticks)
+        if running.any():
+            # every running machine gains at least a cycle per step
+            self.deadline = self.steps + int((self.ticks - self.cycles)[running].min())
+
+    def interrupt(self):
+        """
+        Service the lowest pending, enabled interrupt on every machine that can
+        take one, as CPU.interrupt does.
+        Returns whether any running machine still has a bit set in IS.
+        """
+        reg = self.reg
+        masked = reg[:, IM] & reg[:, IS]
+        m = np.flatnonzero((masked != 0) & self.canInterrupt & self.running)
+        if m.size:
+            number = LOWEST_BIT[masked[m]]
+            self.canInterrupt[m] = False
+            reg[m, IS] &= ~(np.uint8(1) << number)
+            # PC, FL, then R0-R6
+            for value in (self.pc[m], self.fl[m], *reg[m, :7].T):
+                self.push(m, value)
+            self.pc[m] = self.ram[m, INT_VECTORS + number]
+        return bool(((reg[:, IS] != 0) & self.running).any())
+
+    def binary(self, ufunc):
+        """Build a handler for a register-to-register ALU operation."""
+        def handler(m, a, b):
+            reg = self.reg
+            reg[m, a] = ufunc(reg[m, a], reg[m, b])
+            self.advance(m, 3)
+        return handler
+
+    def NOP(self, m, a, b):
+        self.advance(m, 1)
+
+    def HLT(self, m, a, b):
+        self.running[m] = False
+        self.advance(m, 1)
+
+    def LDI(self, m, a, b):
+        self.reg[m, a] = b
+        self.advance(m, 3)
+
+    def ADDI(self, m, a, b):
+        self.reg[m, a] += b
+        self.advance(m, 3)
+
+    def ALU_INC(self, m, a, b):
+        self.reg[m, a] += np.uint8(1)
+        self.advance(m, 2)
+
+    def ALU_DEC(self, m, a, b):
+        self.reg[m, a] -= np.uint8(1)
+        self.advance(m, 2)
+
+    def ALU_NOT(self, m, a, b):
+        self.reg[m, a] = ~self.reg[m, a]
+        self.advance(m, 2)
+
+    def ALU_CMP(self, m, a, b):
+        x = self.reg[m, a]
+        y = self.reg[m, b]
+        self.fl[m] = ((x < y).astype(np.uint8) << 2) | ((x > y).astype(np.uint8) << 1) | (x == y)
+        self.advance(m, 3)
+
+    def divide(self, m, a, b, ufunc):
+        y = self.reg[m, b]
+        zero = y == 0
+        if zero.any():
+            # Division by zero halts just the machines it happens on
+            m, a = self.expand(m, a)
+            self.fail(m[zero])
+            ok = ~zero
+            m, a, y = m[ok], a[ok], y[ok]
+        self.reg[m, a] = ufunc(self.reg[m, a], y)
+        self.advance(m, 3)
+
+    def ALU_DIV(self, m, a, b):
+        self.divide(m, a, b, np.floor_divide)
+
+    def ALU_MOD(self, m, a, b):
+        self.divide(m, a, b, np.remainder)
+
+    def ALU_SHL(self, m, a, b):
+        x = self.reg[m, a].astype(np.uint16)
+        y = np.minimum(self.reg[m, b], 8)
+        self.reg[m, a] = (x << y) & 0xFF
+        self.advance(m, 3)
+
+    def ALU_SHR(self, m, a, b):
+        x = self.reg[m, a].astype(np.uint16)
+        y = np.minimum(self.reg[m, b], 8)
+        self.reg[m, a] = x >> y
+        self.advance(m, 3)
+
+    def LD(self, m, a, b):
+        self.reg[m, a] = self.ram[self.indices(m), self.reg[m, b]]
+        self.advance(m, 3)
+
+    def ST(self, m, a, b):
+        self.ram[self.indices(m), self.reg[m, a]] = self.reg[m, b]
+        self.advance(m, 3)
+
+    def PRN(self, m, a, b):
+        for machine, value in zip(self.indices(m).tolist(), self.reg[m, a].tolist()):
+            self.output[machine].append(f"{value}\n")
+        self.advance(m, 2)
+
+    def PRA(self, m, a, b):
+        for machine, value in zip(self.indices(m).tolist(), self.reg[m, a].tolist()):
+            self.output[machine].append(chr(value))
+        self.advance(m, 2)
+
+    def PUSH(self, m, a, b):
+        self.push(self.indices(m), self.reg[m, a])
+        self.advance(m, 2)
+
+    def POP(self, m, a, b):
+        # popping an empty stack raises in the interpreter
+        empty = self.reg[m, SP] >= STACK_TOP
+        if empty.any():
+            m, a = self.expand(m, a)
+            self.fail(m[empty])
+            ok = ~empty
+            m, a = m[ok], a[ok]
+        self.reg[m, a] = self.pop(self.indices(m))
+        self.advance(m, 2)
+
+    def CALL(self, m, a, b):
+        target = self.reg[m, a]
+        self.push(self.indices(m), self.pc[m] + np.uint8(2))
+        self.pc[m] = target
+
+    def RET(self, m, a, b):
+        self.pc[m] = self.pop(self.indices(m))
+
+    def INT(self, m, a, b):
+        self.reg[m, IS] |= np.left_shift(np.uint8(1), self.reg[m, a] & 0b111)
+        self.pending = True
+        self.advance(m, 2)
+
+    def IRET(self, m, a, b):
+        rows = self.indices(m)
+        for i in range(6, -1, -1):
+            self.reg[m, i] = self.pop(rows)
+        self.fl[m] = self.pop(rows)
+        self.pc[m] = self.pop(rows)
+        self.canInterrupt[m] = True
+        # IS came back off the stack
+        self.pending = True
+
+    def jump_if(self, m, a, taken):
+        bad = taken & (a > 7)
+        if bad.any():
+            m, a = self.expand(m, a)
+            self.fail(m[bad])
+            ok = ~bad
+            m, a, taken = m[ok], a[ok], taken[ok]
+        # machines not jumping may name any register; theirs is read but not used
+        self.jump(m, np.where(taken, self.reg[m, a & 0b111], self.pc[m] + np.uint8(2)))
+
+    def JMP(self, m, a, b):
+        self.jump(m, self.reg[m, a])
+
+    def JEQ(self, m, a, b):
+        self.jump_if(m, a, (self.fl[m] & 1) == 1)
+
+    def JNE(self, m, a, b):
+        self.jump_if(m, a, (self.fl[m] & 1) == 0)
@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks for the LS-8 emulator.
+
+    python bench.py [--jit | --fuse | --loops] [--repeat N] [--save results.json] [--compare baseline.json] [name ...]
+    python bench.py --footprint [N]
+    python bench.py --batch [N] [name ...]
+
+Runs every workload (or only the named ones), printing instructions per second,
+wall time and peak memory. --save writes the results as JSON and --compare
+prints the change against a previous --save.
+
+--footprint measures the memory of N CPU instances (10000 by default), idle
+and after running a program, and the cost of CPU attribute access.
+
+--batch runs each workload on N machines at once (1000 by default) with the
+NumPy lockstep engine, printing instructions per second across the batch, and
+checks every machine's final state against the interpreter. The divergent
+workload starts the machines from different inputs, and checks each one
+against the interpreter run from the same inputs.
+"""
+
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+
+from cpu import CPU
+from devices import BufferedOutput, MemoryOutput
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "asm"))
+import asm
+
+# Example programs that halt on their own
+EXAMPLES = ["call", "mult", "print8", "printstr", "sctest", "stack"]
+
+# Per-instance budget, idle and after running a program: 100k instances in under 400 MiB
+FOOTPRINT_TARGET = 4096
+
+# Synthetic long-running workloads.
+# R5-R7 (IM, IS, SP) are left alone, so no interrupt can fire and the stack stays intact.
+WORKLOADS = {
+    # 256 x 256 nested counter loops
+    "counter": """
+        LDI R0,0
+        LDI R1,0
+        LDI R2,0
+        LDI R3,Outer
+        LDI R4,Inner
+    Outer:
+        LDI R1,0
+    Inner:
+        INC R1
+        CMP R1,R2
+        JNE R4
+        INC R0
+        CMP R0,R2
+        JNE R3
+        HLT
+    """,
+    # 200 rounds of 100-deep CALL/RET recursion
+    "recursion": """
+        LDI R1,0
+        LDI R2,Rec
+        LDI R4,200
+    Loop:
+        LDI R0,100
+        CALL R2
+        DEC R4
+        CMP R4,R1
+        LDI R3,Loop
+        JNE R3
+        HLT
+    Rec:
+        CMP R0,R1
+        LDI R3,RecEnd
+        JEQ R3
+        DEC R0
+        CALL R2
+    RecEnd:
+        RET
+    """,
+    # 200 rounds of pushing then popping 64 values
+    "stack": """
+        LDI R1,0
+        LDI R4,200
+    Round:
+        LDI R0,64
+        LDI R3,Push
+    Push:
+        PUSH R0
+        DEC R0
+        CMP R0,R1
+        JNE R3
+        LDI R0,64
+        LDI R3,Pop
+    Pop:
+        POP R2
+        DEC R0
+        CMP R0,R1
+        JNE R3
+        DEC R4
+        CMP R4,R1
+        LDI R3,Round
+        JNE R3
+        HLT
+    """,
+    # 200 rounds of copying 64 bytes from 0x80 to 0xC0 with LD/ST
+    "memory": """
+        LDI R4,200
+    Round:
+        LDI R0,0x80
+        LDI R1,0xC0
+        LDI R2,0xC0
+    Copy:
+        LD R3,R0
+        ST R1,R3
+        INC R0
+        INC R1
+        CMP R0,R2
+        LDI R3,Copy
+        JNE R3
+        LDI R2,0
+        DEC R4
+        CMP R4,R2
+        LDI R3,Round
+        JNE R3
+        HLT
+    """,
+}
+
+# For --batch: each machine starts from its own R0 (rounds), R1 (start) and
+# RAM[0xE0] (step). Odd sums are printed and raise I1, whose handler counts
+# them in RAM[0xE1]; then the program idles until the timer interrupt halts it.
+DIVERGENT = """
+        LDI R2,Tick
+        LDI R3,0xF8
+        ST R3,R2
+        LDI R2,Odd
+        INC R3
+        ST R3,R2
+        LDI R5,3
+        LDI R3,0xE0
+        LD R4,R3
+    Loop:
+        ADD R1,R4
+        LDI R2,1
+        AND R2,R1
+        LDI R3,0
+        CMP R2,R3
+        LDI R3,Next
+        JEQ R3
+        PRN R1
+        LDI R2,1
+        INT R2
+    Next:
+        DEC R0
+        LDI R3,0
+        CMP R0,R3
+        LDI R3,Loop
+        JNE R3
+        LDI R3,Idle
+    Idle:
+        JMP R3
+    Tick:
+        HLT
+    Odd:
+        LDI R3,0xE1
+        LD R2,R3
+        INC R2
+        ST R3,R2
+        IRET
+"""
+# Distinct input sets for DIVERGENT; machine i gets set i % DIVERGENT_INPUTS
+DIVERGENT_INPUTS = 64
+
+# Prints 'A' 255 * 64 times, then a newline
+OUTPUT_LOOP = """
+    LDI R0,65
+    LDI R1,0
+    LDI R2,64
+    LDI R3,Inner
+    LDI R4,Outer
+Outer:
+    LDI R5,0
+Inner:
+    PRA R0
+    DEC R5
+    CMP R5,R1
+    JNE R3
+    DEC R2
+    CMP R2,R1
+    JNE R4
+    LDI R0,10
+    PRA R0
+    HLT
+"""
+
+
+class UnbufferedOutput:
+    """Baseline device: one write and flush per PRN/PRA, like calling print() on a terminal."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        self.stream.write(text)
+        self.stream.flush()
+
+    def flush(self):
+        self.stream.flush()
+
+
+def assemble(source):
+    """Assemble LS-8 source text into raw program bytes."""
+    return asm.assemble(source)[0]
+
+
+def load_workloads():
+    """Return (name, program bytes) for every benchmark workload."""
+    workloads = []
+    for name in EXAMPLES:
+        with open(os.path.join(HERE, "..", "asm", f"{name}.asm")) as file:
+            workloads.append((f"example/{name}", assemble(file.read())))
+    for name, source in WORKLOADS.items():
+        workloads.append((f"synthetic/{name}", assemble(source)))
+    return workloads
+
+
+# Optional interpreter speedups, by command line flag
+FEATURES = {
+    "--fuse": CPU.enable_fusion,
+    "--loops": CPU.enable_loops,
+}
+
+
+def timed_run(program, output, jit=False, features=()):
+    """Run `program` on a fresh CPU; returns (seconds, instructions executed)."""
+    cpu = CPU(output=output)
+    cpu.load_memory(program)
+    cpu.canRun = True
+    for feature in features:
+        FEATURES[feature](cpu)
+    start = time.perf_counter()
+    if jit:
+        cpu.run_jit()
+    else:
+        cpu.run()
+    return time.perf_counter() - start, cpu.cycles
+
+
+def peak_memory(program, jit=False, features=()):
+    """Peak bytes allocated while running `program` (a separate, untimed run)."""
+    tracemalloc.start()
+    try:
+        timed_run(program, MemoryOutput(), jit, features)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_workload(program, jit=False, repeat=5, features=()):
+    """Best-of-`repeat` timing of one workload."""
+    runs = [timed_run(program, MemoryOutput(), jit, features) for _ in range(repeat)]
+    seconds, instructions = min(runs)
+    return {
+        "instructions": instructions,
+        "seconds": seconds,
+        "mips": instructions / seconds / 1e6,
+        "peak_bytes": peak_memory(program, jit, features),
+    }
+
+
+def bench_output(repeat=5):
+    """Compare output devices on an output-heavy loop writing to a line-buffered file."""
+    program = assemble(OUTPUT_LOOP)
+    with open(os.devnull, "w", buffering=1) as devnull:
+        devices = {
+            "unbuffered": lambda: UnbufferedOutput(devnull),
+            "buffered": lambda: BufferedOutput(devnull),
+            "memory": MemoryOutput,
+        }
+        for name, device in devices.items():
+            best = min(timed_run(program, device())[0] for _ in range(repeat))
+            print(f"output/{name:<12} {best * 1000:8.2f} ms")
+
+
+def instance_footprint(count, program=None):
+    """Bytes allocated per CPU for `count` instances, after running `program` on each if given."""
+    CPU(output=MemoryOutput())  # first-instance costs (imports, caches) don't count
+    tracemalloc.start()
+    try:
+        cpus = []
+        for _ in range(count):
+            cpu = CPU(output=MemoryOutput())
+            if program is not None:
+                cpu.load_memory(program)
+                cpu.canRun = True
+                cpu.run()
+            cpus.append(cpu)
+        return tracemalloc.get_traced_memory()[0] / count
+    finally:
+        tracemalloc.stop()
+
+
+def bench_footprint(count=10000):
+    """Per-instance memory and attribute access times; returns False if any is over FOOTPRINT_TARGET."""
+    idle = instance_footprint(count)
+    print(f"{'footprint':<22} {'bytes/cpu':>9} {'MiB per 100k':>12}")
+    print(f"{'idle':<22} {idle:>9.0f} {idle * 100_000 / 2**20:>12.1f}")
+    largest = idle
+    for name, program in load_workloads():
+        if name.startswith("example/"):
+            used = instance_footprint(count // 10, program)
+            largest = max(largest, used)
+            print(f"{'after ' + name:<22} {used:>9.0f} {used * 100_000 / 2**20:>12.1f}")
+
+    cpu = CPU(output=MemoryOutput())
+    number = 1_000_000
+    accesses = {
+        "read pc": "cpu.pc",
+        "write pc": "cpu.pc = 1",
+        "test E flag": "cpu.fl & cpu.FL_E",
+        "read register": "cpu.reg[cpu.SP]",
+    }
+    print(f"\n{'attribute access':<22} {'ns':>9}")
+    for name, statement in accesses.items():
+        best = min(timeit.repeat(statement, globals={"cpu": cpu}, number=number, repeat=5))
+        print(f"{name:<22} {best / number * 1e9:>9.1f}")
+
+    within = largest <= FOOTPRINT_TARGET
+    print(f"\nlargest footprint ({largest:.0f} bytes) {'within' if within else 'OVER'} "
+          f"the {FOOTPRINT_TARGET} byte target")
+    return within
+
+
+def batch_mismatches(batch, cpu, output, machines=slice(None)):
+    """Names of the state that differs between `machines` in `batch` and the finished `cpu`."""
+    import numpy as np
+
+    expected = {
+        "reg": np.array(cpu.reg, dtype=np.uint8),
+        "ram": np.frombuffer(bytes(cpu.ram), dtype=np.uint8),
+        "pc": cpu.pc,
+        "fl": cpu.fl,
+        "cycles": cpu.cycles,
+    }
+    mismatches = [name for name, value in expected.items()
+                  if not (getattr(batch, name)[machines] == value).all()]
+    if batch.failed[machines].any():
+        mismatches.append("failed")
+    if any("".join(batch.output[machine]) != output
+           for machine in range(batch.count)[machines]):
+        mismatches.append("output")
+    return mismatches
+
+
+def divergent_inputs(count):
+    """DIVERGENT_INPUTS sets of (R0, R1, RAM[0xE0]) values, always the same ones."""
+    import random
+
+    generator = random.Random(8)
+    return [(generator.randrange(256), generator.randrange(256), generator.randrange(256))
+            for _ in range(min(count, DIVERGENT_INPUTS))]
+
+
+def run_divergent(count):
+    """Run DIVERGENT on `count` machines with varied inputs; returns (batch, seconds, mismatches)."""
+    from batch import BatchCPU
+
+    program = assemble(DIVERGENT)
+    inputs = divergent_inputs(count)
+    batch = BatchCPU(count)
+    batch.load(program)
+    for i, (rounds, start, step) in enumerate(inputs):
+        batch.reg[i::len(inputs), 0] = rounds
+        batch.reg[i::len(inputs), 1] = start
+        batch.ram[i::len(inputs), 0xE0] = step
+    start = time.perf_counter()
+    batch.run()
+    seconds = time.perf_counter() - start
+
+    mismatches = set()
+    for i, (rounds, start, step) in enumerate(inputs):
+        output = MemoryOutput()
+        cpu = CPU(output=output)
+        cpu.load_memory(program)
+        cpu.reg[0] = rounds
+        cpu.reg[1] = start
+        cpu.ram[0xE0] = step
+        cpu.canRun = True
+        cpu.run()
+        mismatches.update(batch_mismatches(batch, cpu, output.getvalue(),
+                                           slice(i, None, len(inputs))))
+    return batch, seconds, sorted(mismatches)
+
+
+def bench_batch(count=1000, names=()):
+    """Time BatchCPU on each workload; returns False if any machine ends up unlike the interpreter."""
+    from batch import BatchCPU
+
+    same = True
+    print(f"{'workload':<22} {'machines':>8} {'instructions':>12} {'wall ms':>9} {'MIPS':>7}  state")
+    for name, program in load_workloads():
+        if names and not any(n in name for n in names):
+            continue
+        output = MemoryOutput()
+        cpu = CPU(output=output)
+        cpu.load_memory(program)
+        cpu.canRun = True
+        cpu.run()
+
+        batch = BatchCPU(count)
+        batch.load(program)
+        start = time.perf_counter()
+        batch.run()
+        seconds = time.perf_counter() - start
+
+        mismatches = batch_mismatches(batch, cpu, output.getvalue())
+        same = same and not mismatches
+        print_batch(name, batch, seconds, mismatches)
+
+    if not names or any(n in "synthetic/divergent" for n in names):
+        batch, seconds, mismatches = run_divergent(count)
+        same = same and not mismatches
+        print_batch("synthetic/divergent", batch, seconds, mismatches)
+    return same
+
+
+def print_batch(name, batch, seconds, mismatches):
+    print(f"{name:<22} {batch.count:>8} {batch.instructions:>12} {seconds * 1000:>9.2f} "
+          f"{batch.instructions / seconds / 1e6:>7.3f}  "
+          f"{'differs: ' + ', '.join(mismatches) if mismatches else 'matches interpreter'}")
+
+
+def main(argv):
+    args = argv[1:]
+    if args and args[0] == "--footprint":
+        return 0 if bench_footprint(*map(int, args[1:2])) else 1
+    if args and args[0] == "--batch":
+        args.pop(0)
+        count = int(args.pop(0)) if args and args[0].isdigit() else 1000
+        return 0 if bench_batch(count, args) else 1
+
+    jit = False
+    features = []
+    repeat = 5
+    save = None
+    compare = None
+    names = []
+
+    while args:
+        arg = args.pop(0)
+        if arg == "--jit":
+            jit = True
+        elif arg in FEATURES:
+            features.append(arg)
+        elif arg == "--repeat":
+            repeat = int(args.pop(0))
+        elif arg == "--save":
+            save = args.pop(0)
+        elif arg == "--compare":
+            compare = args.pop(0)
+        else:
+            names.append(arg)
+
+    baseline = {}
+    if compare is not None:
+        with open(compare) as file:
+            baseline = json.load(file)["workloads"]
+
+    results = {}
+    print(f"{'workload':<22} {'instructions':>12} {'wall ms':>9} {'MIPS':>7} {'peak KiB':>9}")
+    for name, program in load_workloads():
+        if names and not any(n in name for n in names):
+            continue
+        result = bench_workload(program, jit, repeat, features)
+        results[name] = result
+        line = (f"{name:<22} {result['instructions']:>12} {result['seconds'] * 1000:>9.2f} "
+                f"{result['mips']:>7.3f} {result['peak_bytes'] / 1024:>9.1f}")
+        if name in baseline:
+            change = result["mips"] / baseline[name]["mips"] - 1
+            line += f"  {change:+.1%} vs baseline"
+        print(line)
+
+    if save is not None:
+        with open(save, "w") as file:
+            json.dump({
+                "mode": "jit" if jit else " ".join(["interpreter"] + features),
+                "python": platform.python_version(),
+                "timestamp": time.time(),
+                "workloads": results,
+            }, file, indent=2)
+
+    if not names or "output" in names:
+        bench_output(repeat)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
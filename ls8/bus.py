@@ -0,0 +1,81 @@
+"""Paged memory bus for the LS-8 CPU."""
+
+# 256 bytes of address space in 16 pages of 16 bytes
+PAGE_BITS = 4
+PAGE_SIZE = 1 << PAGE_BITS
+PAGES = 256 >> PAGE_BITS
+
+
+class Page:
+    """A page with devices mapped into some of its addresses; the rest is RAM."""
+
+    __slots__ = ("devices", "ram")
+
+    def __init__(self, ram):
+        # device (or None for RAM) at each address of the page
+        self.devices = [None] * PAGE_SIZE
+        self.ram = ram
+
+    def __getitem__(self, address):
+        device = self.devices[address & (PAGE_SIZE - 1)]
+        return self.ram[address] if device is None else device.read(address)
+
+    def __setitem__(self, address, value):
+        device = self.devices[address & (PAGE_SIZE - 1)]
+        if device is None:
+            self.ram[address] = value
+        else:
+            device.write(address, value)
+
+
+class Bus:
+    """
+    Routes CPU memory accesses by page.
+
+    `table[address >> PAGE_BITS][address]` reads and writes any address. A
+    plain RAM page's entry is the RAM bytearray itself, so LD/ST/stack
+    accesses there are a direct bytearray subscript that never looks for a
+    device. Only a page with a device mapped into it has a Page entry, which
+    checks its 16 addresses one by one (unmapped addresses in the page still
+    read and write RAM).
+
+    A device is any object with `read(address)` and `write(address, value)`
+    (see devices.Device). `value` is already masked to 8 bits.
+    """
+
+    __slots__ = ("ram", "table")
+
+    def __init__(self, ram):
+        self.ram = ram
+        self.table = [ram] * PAGES
+
+    def map(self, device, start, end=None):
+        """Attach `device` to addresses start..end-1 (just `start` by default). Returns the device."""
+        if end is None:
+            end = start + 1
+        if not 0 <= start < end <= 256:
+            raise ValueError(f"Bad device range {start:#04x}-{end:#04x}")
+        for address in range(start, end):
+            number = address >> PAGE_BITS
+            if self.table[number] is self.ram:
+                self.table[number] = Page(self.ram)
+            self.table[number].devices[address & (PAGE_SIZE - 1)] = device
+        return device
+
+    def unmap(self, start, end=None):
+        """Detach whatever devices are at start..end-1; pages left empty go back to plain RAM."""
+        if end is None:
+            end = start + 1
+        for address in range(start, end):
+            number = address >> PAGE_BITS
+            page = self.table[number]
+            if page is self.ram:
+                continue
+            page.devices[address & (PAGE_SIZE - 1)] = None
+            if not any(page.devices):
+                self.table[number] = self.ram
+
+    def device(self, address):
+        """The device mapped at `address`, or None for RAM."""
+        page = self.table[address >> PAGE_BITS]
+        return None if page is self.ram else page.devices[address & (PAGE_SIZE - 1)]
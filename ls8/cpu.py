@@ -1,32 +1,146 @@
 """CPU functionality."""
 
+import os
+import struct
 import sys
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+
+from analysis import Analysis
+from bus import PAGE_BITS, PAGE_SIZE, Bus
+from devices import BufferedOutput, Timer
+from fusion import SPAN, Fusion
+from jit import JIT
+from loops import JNE, LoopAccelerator
+from profiler import Profiler
+from scheduler import NEVER, Scheduler
+from tracer import Tracer
+
+"""
+Binary program images (written by asm.py for `.ls8b` and `.bin` outputs)
+
+A `.bin` file is the raw program bytes. An `.ls8b` file starts with a header:
+    magic "LS8B", version, entry point, code length (2 bytes),
+    CRC-32 of the code (4 bytes), symbol count (2 bytes)
+followed by the code bytes and the symbol table
+(name length, name, address per symbol). All fields are little-endian.
+"""
+IMAGE_MAGIC = b"LS8B"
+IMAGE_VERSION = 1
+IMAGE_HEADER = struct.Struct("<4sBBHIH")
+BINARY_EXTENSIONS = (".ls8b", ".bin")
+
+# Assembler used to load `.asm` sources directly
+ASM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "asm")
+
+"""
+Snapshots
+
+An immutable copy of the CPU state. RAM is kept as 16 pages of 16 bytes; pages
+that did not change since the previous snapshot are shared with it instead of copied.
+"""
+Snapshot = namedtuple("Snapshot", ["pc", "reg", "fl", "canInterrupt", "canRun", "halted", "idle",
+                                   "spinning", "cycles", "events", "pages"])
+
+"""
+Pre-decoded entries
+
+A plain instruction's entry holds the unbound handler from the branchtable
+(the run loop passes the CPU), so it depends only on the instruction's bytes
+and one tuple is shared by every CPU that decodes them.
+"""
+ENTRIES = {}
+# Start the shared entries afresh past this many, rather than grow without bound
+ENTRIES_LIMIT = 1 << 16
 
 class CPU:
-    """Main CPU class."""
-
-    def __init__(self):
-        """Construct a new CPU."""
+    """
+    Main CPU class.
+
+    State lives in `__slots__`, constants and the branchtable on the class,
+    so an idle instance costs a few KiB (`python bench.py --footprint`).
+    """
+
+    __slots__ = (
+        "canRun", "output", "pc", "fl", "cycles", "deadline", "idle", "spinning",
+        "halted", "scheduler", "decoded", "jit", "fusion", "loops", "snapshotPages",
+        "symbols", "canInterrupt", "ram", "reg", "bus", "pageTable",
+        "debugger",
+    )
+
+    """
+    FL: Flags, packed as `00000LGE`
+    """
+    FL_E = 0b001
+    FL_G = 0b010
+    FL_L = 0b100
+
+    """
+    Interrupt Addresses: the vector table lives in RAM at 0xF8-0xFF (I0-I7)
+    """
+    INT_VECTORS = 0xF8
+    INT_TIMER = 0xF8
+    INT_KEYBOARD = 0xF9
+    KEY_PRESSED = 0xF4
+    STACK_TOP = 0xF3
+
+    """
+    Reserved registers
+    """
+    IM = 5  # interrupt mask
+    IS = 6  # interrupt status
+    SP = 7  # stack pointer
+
+    def __init__(self, output=None):
+        """
+        Construct a new CPU.
+        `output` is the device PRN and PRA write to (a buffered stdout writer by default).
+        """
         self.canRun = False
+        self.output = output if output is not None else BufferedOutput()
         """
         Internal Registers
         """
         # PC: Program Counter, address of the currently executing instruction
         self.pc = 0
-        # IR: Instruction Register, contains a copy of the currently executing instruction
-        self.ir = [0] * 256
-        # FL: Flags
-        self.E = 0
-        self.L = 0
-        self.G = 0
-        # Interrupt Addresses
-        self.I = [0] * 8 # 0xF8, 0xF9, 0xFA, 0xFB, 0xFC, 0xFD, 0xFE, 0xFF
-        self.INT_TIMER = 0xF8
-        self.INT_KEYBOARD = 0xF9
-        self.KEY_PRESSED = 0xF4
+        # Number of instructions executed so far
+        self.cycles = 0
+        # Future events keyed by cycle count; `deadline` is the earliest one
+        self.deadline = NEVER
+        self.idle = False
+        # Set by spin(); lets a driver (e.g. the keyboard event loop) see the program is waiting
+        self.spinning = False
+        # Set by HLT, as opposed to a paused run
+        self.halted = False
+        self.scheduler = Scheduler(self)
+        # Timer interrupt (I0): once per second of emulated time
+        Timer(self)
+        # Pre-decoded instruction stream: one (handler, operand_a, operand_b, length) entry per address,
+        # shared with other CPUs for plain instructions (see plain_entry)
+        self.decoded = [None] * 256
+        # Basic-block compiler, created by run_jit()
+        self.jit = None
+        # Superinstruction fusion, switched on by enable_fusion()
+        self.fusion = None
+        # Counted-loop fast-forward, switched on by enable_loops()
+        self.loops = None
+        # Breakpoints and watchpoints, created by debug()
+        self.debugger = None
+        # Pages of the last snapshot taken, shared with the next one where unchanged
+        self.snapshotPages = None
+        # Symbol table of the loaded image (label -> address), if it has one
+        self.symbols = {}
+        # FL: Flags (`00000LGE`)
+        self.fl = 0
         self.canInterrupt = True
-        # RAM
-        self.ram = dict()
+        # RAM: 256 bytes, cleared to 0 on power on
+        self.ram = bytearray(256)
+        # Memory bus: devices are mapped over RAM page by page (see bus.py).
+        # ram_read/ram_write go through its page table; nothing is mapped at
+        # power on, drivers map their devices when they attach.
+        self.bus = Bus(self.ram)
+        self.pageTable = self.bus.table
         """
         8 general-purpose 8-bit numeric registers R0-R7.
             R5 is reserved as the interrupt mask (IM)
@@ -37,88 +151,18 @@ class CPU:
         to keep the register values in that range.
         """
         self.reg = [0] * 8
-
-        self.IM = 5
-        self.IS = 6
-        self.SP = 7
-
         self.reg[self.IM] = 0b00000000 # interrupt mask (IM)
         self.reg[self.IS] = 0b00000000 # interrupt status (IS)
-        self.reg[self.SP] = 0xF3 # stack pointer (SP)
-
-        """
-        Branchtable
-        """
-        self.branchtable = {}
-        # OTHERS
-        self.branchtable[0b00000001] = self.HLT
-        self.branchtable[0b10000010] = self.LDI
-        self.branchtable[0b10000110] = self.ADDI
-        self.branchtable[0b01000111] = self.PRN
-        self.branchtable[0b10000011] = self.LD
-        self.branchtable[0b01001000] = self.PRA
-        """
-        NOP
-        """
-        self.branchtable[0b00000000] = self.NOP
-        """
-        ALU Operations
-        ADD  10100000 00000aaa 00000bbb
-        SUB  10100001 00000aaa 00000bbb
-        MUL  10100010 00000aaa 00000bbb
-        DIV  10100011 00000aaa 00000bbb
-        MOD  10100100 00000aaa 00000bbb
-        INC  01100101 00000rrr
-        DEC  01100110 00000rrr
-        CMP  10100111 00000aaa 00000bbb
-        AND  10101000 00000aaa 00000bbb
-        NOT  01101001 00000rrr
-        OR   10101010 00000aaa 00000bbb
-        XOR  10101011 00000aaa 00000bbb
-        SHL  10101100 00000aaa 00000bbb
-        SHR  10101101 00000aaa 00000bbb
-        """
-        self.branchtable[0b10100000] = self.ALU_ADD
-        self.branchtable[0b10100001] = self.ALU_SUB
-        self.branchtable[0b10100010] = self.ALU_MUL
-        self.branchtable[0b10100011] = self.ALU_DIV
-        self.branchtable[0b10100100] = self.ALU_MOD
-        self.branchtable[0b01100101] = self.ALU_INC
-        self.branchtable[0b01100110] = self.ALU_DEC
-        self.branchtable[0b10100111] = self.ALU_CMP
-        self.branchtable[0b10101000] = self.ALU_AND
-        self.branchtable[0b01101001] = self.ALU_NOT
-        self.branchtable[0b10101010] = self.ALU_OR
-        self.branchtable[0b10101011] = self.ALU_XOR
-        self.branchtable[0b10101100] = self.ALU_SHL
-        self.branchtable[0b10101101] = self.ALU_SHR
-        """
-        Stack
-        """
-        self.branchtable[0b01000101] = self.PUSH
-        self.branchtable[0b01000110] = self.POP
-        """
-        CALL & RET
-        """
-        self.branchtable[0b01010000] = self.CALL
-        self.branchtable[0b00010001] = self.RET
-        """
-        JUMPS
-        """
-        self.branchtable[0b01010100] = self.JMP
-        self.branchtable[0b01010101] = self.JEQ
-        self.branchtable[0b01010110] = self.JNE
-        """
-        Interrupts
-        """
-        self.branchtable[0b10000100] = self.ST
-        self.branchtable[0b01010010] = self.INT
-        self.branchtable[0b00010011] = self.IRET
+        self.reg[self.SP] = self.STACK_TOP # stack pointer (SP)
 
     def load(self, filename):
         """Load a program into memory."""
+        if filename.endswith(BINARY_EXTENSIONS):
+            return self.load_image(filename)
+        if filename.endswith(".asm"):
+            return self.load_source(filename)
         try:
-            address = 0
+            program = bytearray()
             with open(filename, 'r') as file:
                 allLines = file.readlines()
                 for i in range(0, len(allLines)):
@@ -126,13 +170,208 @@ class CPU:
                     if '#' in allLines[i]:
                         line = allLines[i].split('#')[0].strip()
                     if len(line) > 0:
-                        self.ram[address] = int(line, 2)
-                        address += 1
+                        program.append(int(line, 2))
+            self.load_memory(program)
             self.canRun = True
         except FileNotFoundError:
-            print(f"{sys.argv[0]}: {sys.argv[1]} not found")
+            print(f"{sys.argv[0]}: {filename} not found")
+            sys.exit(2)
+
+    def load_bytes(self, program, symbols=None):
+        """
+        Load an assembled program (e.g. from asm.assemble) straight into RAM,
+        with its symbol table, skipping any file or text round trip.
+        """
+        self.load_memory(program)
+        self.symbols = dict(symbols or {})
+        self.canRun = True
+
+    def load_source(self, filename):
+        """Assemble an `.asm` file in-process and load the result."""
+        sys.path.insert(0, ASM_DIR)
+        try:
+            import asm
+        finally:
+            sys.path.remove(ASM_DIR)
+        try:
+            with open(filename) as file:
+                self.load_bytes(*asm.assemble(file))
+        except FileNotFoundError:
+            print(f"{sys.argv[0]}: {filename} not found")
             sys.exit(2)
 
+    def load_image(self, filename):
+        """
+        Load a binary program image: a raw `.bin` file or an `.ls8b` file with header.
+        The code is read straight into RAM, without any text parsing.
+        """
+        try:
+            with open(filename, 'rb') as file:
+                magic = file.read(len(IMAGE_MAGIC))
+                if magic != IMAGE_MAGIC:
+                    # raw image: the bytes already read are the start of the program
+                    self.memory[:len(magic)] = magic
+                    file.readinto(self.memory[len(magic):])
+                else:
+                    header = magic + file.read(IMAGE_HEADER.size - len(magic))
+                    _, version, entry, length, checksum, count = IMAGE_HEADER.unpack(header)
+                    if version != IMAGE_VERSION:
+                        raise Exception(f"Unsupported image version {version}")
+                    if file.readinto(self.memory[:length]) != length:
+                        raise Exception("Truncated image")
+                    if zlib.crc32(self.memory[:length]) != checksum:
+                        raise Exception("Image checksum mismatch")
+                    symbols = {}
+                    for _ in range(count):
+                        size = file.read(1)[0]
+                        name = file.read(size).decode('ascii')
+                        symbols[name] = file.read(1)[0]
+                    self.symbols = symbols
+                    self.pc = entry
+            self.invalidate_all()
+            self.canRun = True
+        except FileNotFoundError:
+            print(f"{sys.argv[0]}: {filename} not found")
+            sys.exit(2)
+
+    def load_memory(self, data, address=0):
+        """
+        Bulk copy `data` (any bytes-like object) into RAM starting at `address`
+        and drop the pre-decoded stream, since the whole image may have changed.
+        """
+        self.memory[address:address + len(data)] = data
+        self.invalidate_all()
+
+    def enable_fusion(self):
+        """
+        Fuse common instruction sequences into single handlers as they are decoded
+        (see fusion.py). Returns the Fusion, whose `stats` count how often each form runs.
+        """
+        if self.fusion is None:
+            self.fusion = Fusion(self)
+            self.invalidate_all()
+        return self.fusion
+
+    def enable_loops(self):
+        """
+        Fast-forward simple counted loops when their closing JNE jumps back
+        (see loops.py). Returns the LoopAccelerator, whose `stats` count the
+        loops and iterations skipped.
+        """
+        if self.loops is None:
+            self.loops = LoopAccelerator(self)
+            self.invalidate_all()
+        return self.loops
+
+    def predecode(self, analysis=None):
+        """
+        Decode every reachable instruction up front instead of on first use
+        (see analysis.py). Returns the Analysis, which can also tell whether
+        the code is provably never overwritten (`is_static()`).
+
+        With unresolved jumps (`analysis.unresolved`) the reachable set is
+        incomplete and `is_static()` is False: the rest is decoded on first
+        use as usual, and writes still invalidate predecoded entries.
+        """
+        if analysis is None:
+            analysis = Analysis.of(self)
+        for pc in sorted(analysis.reachable - analysis.invalid):
+            if self.decoded[pc] is None:
+                self.decode(pc)
+        return analysis
+
+    def debug(self):
+        """
+        The CPU's Debugger (see debugger.py), for breakpoints, watchpoints and
+        stepping. While any are set, `run` uses the debugger's checked loop.
+        """
+        if self.debugger is None:
+            from debugger import Debugger
+            self.debugger = Debugger(self)
+        return self.debugger
+
+    @contextmanager
+    def plain_decoding(self):
+        """
+        Switch fusion and loop fast-forward off for the duration, so every
+        pre-decoded entry is one plain instruction (for the instrumented loops
+        in tracer.py and profiler.py, which record each instruction).
+        """
+        fusion, loops = self.fusion, self.loops
+        if fusion is None and loops is None:
+            yield
+            return
+        self.fusion = self.loops = None
+        self.invalidate_all()
+        try:
+            yield
+        finally:
+            self.fusion, self.loops = fusion, loops
+            self.invalidate_all()
+
+    def invalidate_all(self):
+        """Drop every pre-decoded entry and compiled block."""
+        self.decoded[:] = [None] * 256
+        if self.loops is not None:
+            self.loops.owners.clear()
+        if self.jit is not None:
+            self.jit.reset()
+
+    @property
+    def memory(self):
+        """Zero-copy view of RAM for bulk loads, dumps and devices."""
+        return memoryview(self.ram)
+
+    def dump(self):
+        """Return a copy of the whole RAM as immutable bytes (snapshot/compare)."""
+        return bytes(self.ram)
+
+    def snapshot(self):
+        """
+        Capture registers, flags, PC, interrupt and run state, pending scheduler
+        events (as offsets from the current cycle) and RAM as an immutable Snapshot.
+        """
+        memory = self.memory
+        previous = self.snapshotPages
+        pages = []
+        for i, start in enumerate(range(0, 256, PAGE_SIZE)):
+            page = memory[start:start + PAGE_SIZE]
+            if previous is not None and page == previous[i]:
+                pages.append(previous[i])
+            else:
+                pages.append(page.tobytes())
+        pages = tuple(pages)
+        self.snapshotPages = pages
+        return Snapshot(self.pc, tuple(self.reg), self.fl, self.canInterrupt,
+                        self.canRun, self.halted, self.idle, self.spinning,
+                        self.cycles, self.scheduler.save(), pages)
+
+    def restore(self, snapshot):
+        """
+        Return the CPU to the state captured in `snapshot`.
+        RAM is restored with one copy; only pages that differ drop their decoded code.
+        """
+        memory = self.memory
+        for i, page in enumerate(snapshot.pages):
+            start = i * PAGE_SIZE
+            if memory[start:start + PAGE_SIZE] != page:
+                for address in range(start, start + PAGE_SIZE):
+                    self.invalidate(address)
+        self.ram[:] = b"".join(snapshot.pages)
+        # registers are updated in place, run loops hold on to the list
+        self.reg[:] = snapshot.reg
+        self.fl = snapshot.fl
+        self.pc = snapshot.pc
+        self.canInterrupt = snapshot.canInterrupt
+        self.canRun = snapshot.canRun
+        self.halted = snapshot.halted
+        self.idle = snapshot.idle
+        self.spinning = snapshot.spinning
+        self.cycles = snapshot.cycles
+        # timer and device events fire at the same points as in the original run
+        self.scheduler.load(snapshot.events)
+        self.snapshotPages = snapshot.pages
+
     def regLimit(self, address):
         self.reg[address] = self.reg[address] & 0xFF
 
@@ -149,19 +388,19 @@ class CPU:
         self.regLimit(reg_a)
         
     def ALU_DIV(self, reg_a, reg_b):
-        if self.reg[reg_b] is not 0:
-            self.reg[reg_a] /= self.reg[reg_b]
+        if self.reg[reg_b] != 0:
+            self.reg[reg_a] //= self.reg[reg_b]
             self.regLimit(reg_a)
         else:
-            print('You cannot divide by zero!')
+            self.output.write('You cannot divide by zero!\n')
             self.HLT()
         
     def ALU_MOD(self, reg_a, reg_b):
-        if self.reg[reg_b] is not 0:
+        if self.reg[reg_b] != 0:
             self.reg[reg_a] = self.reg[reg_a] % self.reg[reg_b]
             self.regLimit(reg_a)
         else:
-            print('You cannot divide by zero!')
+            self.output.write('You cannot divide by zero!\n')
             self.HLT()
         
     def ALU_INC(self, reg_a):
@@ -183,9 +422,7 @@ class CPU:
         """
         valA = self.reg[reg_a]
         valB = self.reg[reg_b]
-        self.E = int(valA == valB)
-        self.L = int(valA < valB)
-        self.G = int(valA > valB)
+        self.fl = self.FL_E if valA == valB else self.FL_L if valA < valB else self.FL_G
         
     def ALU_AND(self, reg_a, reg_b):
         self.reg[reg_a] = self.reg[reg_a] & self.reg[reg_b]
@@ -193,6 +430,7 @@ class CPU:
         
     def ALU_NOT(self, reg_a):
         self.reg[reg_a] = ~self.reg[reg_a]
+        self.regLimit(reg_a)
         
     def ALU_OR(self, reg_a, reg_b):
         self.reg[reg_a] = self.reg[reg_a] | self.reg[reg_b]
@@ -210,6 +448,7 @@ class CPU:
         filling the low bits with 0.
         """
         self.reg[reg_a] = self.reg[reg_a] << self.reg[reg_b]
+        self.regLimit(reg_a)
         
     def ALU_SHR(self, reg_a, reg_b):
         """
@@ -220,12 +459,74 @@ class CPU:
 
     def getOperation(self, identifier):
         if identifier in self.branchtable:
-            return self.branchtable[identifier]
+            return self.branchtable[identifier].__get__(self)
         raise Exception("Unsupported operation")
     
+    def decode(self, pc):
+        """
+        Decode the instruction at `pc` once and cache it in the pre-decoded stream.
+        The entry holds the handler, both operands and the instruction length,
+        so `run` only has to do one indexed fetch per instruction.
+        """
+        if self.fusion is not None:
+            entry = self.fusion.fuse(pc)
+            if entry is not None:
+                self.decoded[pc] = entry
+                return entry
+        if self.loops is not None and self.ram[pc] == JNE:
+            entry = self.loops.entry(pc)
+            self.decoded[pc] = entry
+            return entry
+        entry = self.plain_entry(pc)
+        self.decoded[pc] = entry
+        return entry
+
+    def plain_entry(self, pc):
+        """
+        The entry for the single instruction at `pc`, without fusion or loop
+        fast-forward: (unbound handler, operand_a, operand_b, length), taken
+        from ENTRIES when another CPU has decoded the same instruction.
+        """
+        # instruction fetch reads RAM itself, not devices mapped over it
+        ram = self.ram
+        instruction = ram[pc]
+        length = (instruction >> 6) + 1
+        # bytes past the instruction aren't part of it: leave them out so more entries are shared
+        key = (instruction,
+               ram[(pc + 1) & 0xFF] if length > 1 else 0,
+               ram[(pc + 2) & 0xFF] if length > 2 else 0)
+        entry = ENTRIES.get(key)
+        if entry is None:
+            if instruction not in self.branchtable:
+                raise Exception("Unsupported operation")
+            if len(ENTRIES) >= ENTRIES_LIMIT:
+                ENTRIES.clear()
+            entry = ENTRIES[key] = (self.branchtable[instruction], key[1], key[2], length)
+        return entry
+
+    def invalidate(self, mar):
+        """
+        Drop every pre-decoded entry that covers `mar`, i.e. an instruction
+        starting at `mar` or one/two bytes before it (self-modifying code, stack overflow).
+        """
+        decoded = self.decoded
+        decoded[mar & 0xFF] = None
+        decoded[(mar - 1) & 0xFF] = None
+        decoded[(mar - 2) & 0xFF] = None
+        if self.fusion is not None:
+            # fused entries cover up to SPAN bytes
+            for back in range(3, SPAN):
+                decoded[(mar - back) & 0xFF] = None
+        if self.loops is not None and self.loops.owners:
+            self.loops.invalidate(mar)
+        if self.jit is not None:
+            self.jit.invalidate(mar)
+
     def HLT(self):
         """HLT operation"""
         self.canRun = False
+        self.halted = True
+        self.output.flush()
         return False
 
     def NOP(self):
@@ -245,8 +546,8 @@ class CPU:
             #self.fl,
             #self.ie,
             self.ram_read(self.pc),
-            self.ram_read(self.pc + 1),
-            self.ram_read(self.pc + 2)
+            self.ram_read((self.pc + 1) & 0xFF),
+            self.ram_read((self.pc + 2) & 0xFF)
         ), end='')
 
         for i in range(8):
@@ -263,73 +564,134 @@ class CPU:
         If the CPU is not halted by a HLT instruction, go to step 1.
 
         """
-        while self.canRun:
-            # interrupt handling
-            """
-            When an interrupt occurs from an external source or from an `INT`
-            instruction, the appropriate bit in the IS register will be set.
-            """
-            # The IM register is bitwise AND-ed with the IS register and the results stored as maskedInterrupts
-            self.reg[self.IM] = self.reg[self.IM] & self.reg[self.IS]
-            # Each bit of maskedInterrupts is checked, 
-            # starting from 0 and going up to the 7th bit, one for each interrupt
-            maskedInterrupts = "{0:08b}".format(self.reg[self.IM])[::-1]
-            runInterrupt = -1
-            for i in range(0, len(maskedInterrupts)):
-                bit = maskedInterrupts[i]
-                # If a bit is found to be set, follow the next sequence of steps
-                # Stop further checking of maskedInterrupts
-                if bit is '1':
-                    runInterrupt = i
-                    break
-            # If a bit is set and can interrupt now
-            if runInterrupt > -1 and self.canInterrupt:
-                print("Interrupting...")
-                # Disable further interrupts
-                self.canInterrupt = False
-                # Clear the bit in the IS register
-                self.reg[self.IS] = 0b00000000
-                # The PC register is pushed on the stack
-                self.PUSH(self.pc)
-                # The FL register is pushed on the stack
-                self.PUSH(self.E)
-                self.PUSH(self.L)
-                self.PUSH(self.G)
-                # Registers R0-R6 are pushed on the stack in that order
-                for i in range(0, 6):
-                    self.PUSH(self.reg[i])
-                # The address / vector of the appropriate handler is looked up from the interrupt vector table.
-                interrupt = self.I[runInterrupt]
-                # Set the PC is set to the handler address
-                self.pc = interrupt
-                # While an interrupt is being serviced (between the handler being called and the IRET), 
-                # further interrupts are disabled
-            
-            # get instruction
-            instruction = self.ram_read(self.pc)
-            # save it in instruction register
-            self.ir[self.pc] = instruction
-            # get operation name
-            # print(f'run -> {instruction:08b}')
-            operation = self.getOperation(instruction)
-            # print(f'run {instruction:08b} -> pc {self.pc}')
-            # decode instruction
-            instruct = "{0:8b}".format(instruction)
-            # operands = int(instruct[:2].strip() or '00', 2)
-            operands = instruction >> 6
-            # get param 1
-            instruct_a = self.ram_read(self.pc + 1)
-            # get param 2
-            instruct_b = self.ram_read(self.pc + 2)
-
-            if operands == 1:
-                operation(instruct_a)
-            elif operands == 2:
-                operation(instruct_a, instruct_b)
-            else:
-                operation()
-            
-            self.pc += int(operands) + 1
+        if self.debugger is not None and self.debugger.active():
+            # breakpoints or watchpoints set: stop-checking loop instead
+            return self.debugger.run()
+        decoded = self.decoded
+        decode = self.decode
+        reg = self.reg
+        IM = self.IM
+        IS = self.IS
+        cycles = self.cycles
+        try:
+            while self.canRun:
+                # scheduled events (timer, devices) only when the next deadline comes
+                if cycles >= self.deadline:
+                    self.cycles = cycles
+                    self.scheduler.dispatch()
+                    cycles = self.cycles
+
+                # interrupt handling: pending-and-enabled mask, one integer test when idle
+                if reg[IM] & reg[IS] and self.canInterrupt:
+                    self.interrupt()
+
+                # fetch the pre-decoded instruction (decoding it on first use)
+                pc = self.pc
+                operation, operand_a, operand_b, length = decoded[pc] or decode(pc)
+
+                if length == 2:
+                    operation(self, operand_a)
+                elif length == 3:
+                    operation(self, operand_a, operand_b)
+                elif length:
+                    operation(self)
+                else:
+                    # fused sequence: sets the PC and reports the extra instructions it ran
+                    # (loop fast-forward stops short of the deadline, so it needs the cycle count)
+                    self.cycles = cycles
+                    cycles += operation()
+
+                # the PC is 8 bits: running past 0xFF wraps to 0, as in the JIT and BatchCPU
+                self.pc = (self.pc + length) & 0xFF
+                cycles += 1
+        finally:
+            self.cycles = cycles
+            self.output.flush()
+
+    def pause(self):
+        """Stop the run loop after the current instruction, without halting."""
+        self.canRun = False
+
+    def run_slice(self, cycles):
+        """
+        Run for at most `cycles` instructions (fewer if the program halts).
+        Returns False once the program has halted.
+        """
+        if self.halted:
+            return False
+        event = self.scheduler.after(cycles, CPU.pause)
+        self.canRun = True
+        try:
+            self.run()
+        finally:
+            self.scheduler.cancel(event)
+        return not self.halted
+
+    def run_jit(self):
+        """
+        Run the CPU with the basic-block JIT.
+        Straight-line runs of instructions are compiled into Python functions once
+        and dispatched one block at a time instead of one instruction at a time.
+        """
+        if self.jit is None:
+            self.jit = JIT(self)
+        try:
+            self.jit.run()
+        finally:
+            self.output.flush()
+
+    def run_profiled(self):
+        """
+        Run the CPU in the instrumented profiling loop.
+        Returns the Profiler with per-opcode, per-PC and per-subroutine costs.
+        """
+        return Profiler(self).run()
+
+    def run_traced(self, size=65536, dumpfile=None):
+        """
+        Run the CPU recording the last `size` instructions into a binary ring buffer,
+        written to `dumpfile` when the CPU halts or crashes. Returns the Tracer.
+        """
+        return Tracer(self, size, dumpfile).run()
+
+    def interrupt(self):
+        """
+        Service the highest-priority pending interrupt.
+        The IM register is bitwise AND-ed with the IS register; the lowest set bit
+        of that mask (interrupt 0 first) is the one to run.
+        """
+        maskedInterrupts = self.reg[self.IM] & self.reg[self.IS]
+        # isolate the lowest set bit, its position is the interrupt number
+        runInterrupt = (maskedInterrupts & -maskedInterrupts).bit_length() - 1
+        # Disable further interrupts
+        self.canInterrupt = False
+        # Clear the bit in the IS register
+        self.reg[self.IS] &= ~(1 << runInterrupt) & 0xFF
+        # The PC register is pushed on the stack
+        self.pushValue(self.pc)
+        # The FL register is pushed on the stack
+        self.pushValue(self.fl)
+        # Registers R0-R6 are pushed on the stack in that order
+        for i in range(0, 7):
+            self.pushValue(self.reg[i])
+        # The address / vector of the appropriate handler is looked up from the interrupt vector table,
+        # and the PC is set to the handler address
+        self.pc = self.ram_read(self.INT_VECTORS + runInterrupt)
+
+    def raiseInterrupt(self, number):
+        """Flag interrupt `number` (0-7) as pending in the IS register, e.g. from a device."""
+        self.reg[self.IS] |= 1 << number
+
+    def pushValue(self, value):
+        """Decrement SP and store `value` at the new top of the stack."""
+        self.reg[self.SP] = (self.reg[self.SP] - 1) & 0xFF
+        self.ram_write(self.reg[self.SP], value)
+
+    def popValue(self):
+        """Read the value at the top of the stack and increment SP."""
+        value = self.ram_read(self.reg[self.SP])
+        self.reg[self.SP] = (self.reg[self.SP] + 1) & 0xFF
+        return value
 
     def ram_read(self, mar):
         """
@@ -341,14 +703,17 @@ class CPU:
         The number of operands AA is useful to know because 
         the total number of bytes in any instruction is the number of operands + 1 (for the opcode). 
         This allows you to know how far to advance the PC with each instruction.
+
+        Reads go through the bus: RAM directly, or the device mapped at `mar`.
         """
-        if mar in self.ram:
-            return self.ram[mar]
-        return None
+        return self.pageTable[mar >> PAGE_BITS][mar]
 
     def ram_write(self, mar, mdr):
-        self.ram[mar] = mdr
-        return self.ram[mar]
+        """Write the low 8 bits of `mdr` to address `mar` (RAM, or the device mapped there)."""
+        mdr &= 0xFF
+        self.pageTable[mar >> PAGE_BITS][mar] = mdr
+        self.invalidate(mar)
+        return mdr
 
     def LDI(self, register, value):
         """
@@ -368,6 +733,7 @@ class CPU:
         Add an immediate value to a register
         """
         self.reg[int(register)] += value
+        self.regLimit(int(register))
         return self.reg[int(register)]
 
     def PRN(self, register):
@@ -380,7 +746,7 @@ class CPU:
             47 0r
         """
         numericValue = int(self.reg[int(register)])
-        print(numericValue)
+        self.output.write(f"{numericValue}\n")
         return numericValue
     
     def PUSH(self, address):
@@ -395,8 +761,8 @@ class CPU:
         45 0r
         ```
         """
-        self.reg[self.SP] -= 1
-        self.ram[self.reg[self.SP]] = self.reg[address]
+        self.reg[self.SP] = (self.reg[self.SP] - 1) & 0xFF
+        self.ram_write(self.reg[self.SP], self.reg[address])
 
     def POP(self, address):
         """
@@ -409,8 +775,8 @@ class CPU:
         46 0r
         ```
         """
-        if self.reg[self.SP] < 0xF3:
-            self.reg[address] = self.ram[self.reg[self.SP]]
+        if self.reg[self.SP] < self.STACK_TOP:
+            self.reg[address] = self.ram_read(self.reg[self.SP])
             self.reg[self.SP] += 1
             return self.reg[address]
         else:
@@ -431,11 +797,11 @@ class CPU:
         ```
         """
         # print(f'CALL -> go to reg {address:08b}, {self.reg[address]}')
-        # PUSH
-        self.reg[self.SP] -= 1
-        self.ram[self.reg[self.SP]] = self.pc + 1
+        target = self.reg[address]
+        # PUSH the address of the instruction after CALL
+        self.pushValue(self.pc + 2)
         # SET PC
-        self.pc = self.reg[address] - 2 # -2 cause operands
+        self.pc = target - 2 # -2 cause operands
 
     def RET(self):
         """
@@ -448,8 +814,7 @@ class CPU:
         ```
         """
         # POP & SET PC
-        self.pc = self.ram[self.reg[self.SP]]
-        self.reg[self.SP] += 1
+        self.pc = self.popValue() - 1 # -1 cause run advances past RET
 
     def JMP(self, address):
         """
@@ -461,8 +826,21 @@ class CPU:
         54 0r
         ```
         """
-        self.pc = self.reg[address] - 2 # -2 cause operands
-    
+        target = self.reg[address]
+        if target == self.pc:
+            self.spin()
+        self.pc = target - 2 # -2 cause operands
+
+    def spin(self):
+        """
+        The program jumped to the instruction it is on: nothing changes until
+        the next event, so let the scheduler fast-forward to it.
+        """
+        self.spinning = True
+        if self.scheduler.fastForward:
+            self.idle = True
+            self.deadline = self.cycles
+
     def JEQ(self, address):
         """
         If `equal` flag is set (true), jump to the address stored in the given register.
@@ -472,7 +850,7 @@ class CPU:
         55 0r
         ```
         """
-        if self.E is True or self.E is 1:
+        if self.fl & self.FL_E:
             self.JMP(address)
 
     def JNE(self, address):
@@ -485,7 +863,7 @@ class CPU:
         56 0r
         ```
         """
-        if self.E is False or self.E is 0:
+        if not self.fl & self.FL_E:
             self.JMP(address)
 
     def ST(self, reg_a, reg_b):
@@ -511,11 +889,7 @@ class CPU:
         52 0r
         ```
         """
-        interruptNum = self.reg[address]
-        self.pc = interruptNum - 2 # cause operands
-
-        #self.reg[self.IS] = ""
-        #pass
+        self.raiseInterrupt(self.reg[address] & 0b111)
 
     def IRET(self):
         """
@@ -531,7 +905,11 @@ class CPU:
         13
         ```
         """
-        pass
+        for i in range(6, -1, -1):
+            self.reg[i] = self.popValue()
+        self.fl = self.popValue()
+        self.pc = self.popValue() - 1 # -1 cause run advances past IRET
+        self.canInterrupt = True
 
     def LD(self, reg_a, reg_b):
         """
@@ -556,5 +934,76 @@ class CPU:
         48 0r
         ```
         """
-        character = self.reg[address]
-        print(ord(character))
\ No newline at end of file
+        character = chr(self.reg[address])
+        self.output.write(character)
+        return character
+
+    """
+    Branchtable
+    """
+    # opcode -> handler, shared by every instance (bound by getOperation)
+    branchtable = {}
+    # OTHERS
+    branchtable[0b00000001] = HLT
+    branchtable[0b10000010] = LDI
+    branchtable[0b10000110] = ADDI
+    branchtable[0b01000111] = PRN
+    branchtable[0b10000011] = LD
+    branchtable[0b01001000] = PRA
+    """
+    NOP
+    """
+    branchtable[0b00000000] = NOP
+    """
+    ALU Operations
+    ADD  10100000 00000aaa 00000bbb
+    SUB  10100001 00000aaa 00000bbb
+    MUL  10100010 00000aaa 00000bbb
+    DIV  10100011 00000aaa 00000bbb
+    MOD  10100100 00000aaa 00000bbb
+    INC  01100101 00000rrr
+    DEC  01100110 00000rrr
+    CMP  10100111 00000aaa 00000bbb
+    AND  10101000 00000aaa 00000bbb
+    NOT  01101001 00000rrr
+    OR   10101010 00000aaa 00000bbb
+    XOR  10101011 00000aaa 00000bbb
+    SHL  10101100 00000aaa 00000bbb
+    SHR  10101101 00000aaa 00000bbb
+    """
+    branchtable[0b10100000] = ALU_ADD
+    branchtable[0b10100001] = ALU_SUB
+    branchtable[0b10100010] = ALU_MUL
+    branchtable[0b10100011] = ALU_DIV
+    branchtable[0b10100100] = ALU_MOD
+    branchtable[0b01100101] = ALU_INC
+    branchtable[0b01100110] = ALU_DEC
+    branchtable[0b10100111] = ALU_CMP
+    branchtable[0b10101000] = ALU_AND
+    branchtable[0b01101001] = ALU_NOT
+    branchtable[0b10101010] = ALU_OR
+    branchtable[0b10101011] = ALU_XOR
+    branchtable[0b10101100] = ALU_SHL
+    branchtable[0b10101101] = ALU_SHR
+    """
+    Stack
+    """
+    branchtable[0b01000101] = PUSH
+    branchtable[0b01000110] = POP
+    """
+    CALL & RET
+    """
+    branchtable[0b01010000] = CALL
+    branchtable[0b00010001] = RET
+    """
+    JUMPS
+    """
+    branchtable[0b01010100] = JMP
+    branchtable[0b01010101] = JEQ
+    branchtable[0b01010110] = JNE
+    """
+    Interrupts
+    """
+    branchtable[0b10000100] = ST
+    branchtable[0b01010010] = INT
+    branchtable[0b00010011] = IRET
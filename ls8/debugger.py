@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+
+"""
+Breakpoints, watchpoints and an interactive debugger for the LS-8 CPU.
+
+    python debugger.py program.ls8
+
+or `ls8.py --debug program.ls8`. Type `help` at the (ls8) prompt for commands.
+
+While no breakpoint, watchpoint or stop condition is set, `CPU.run` takes its
+normal fast loop; the checked loop here only runs while something is set.
+"""
+
+import cmd
+import sys
+
+from replay import describe, mnemonics
+
+
+class Watch:
+    """
+    Bus device placed over a watched address: writes go on to whatever was
+    mapped there before (RAM or a device) and are reported to the debugger.
+    """
+
+    __slots__ = ("debugger", "cpu", "previous")
+
+    def __init__(self, debugger, previous):
+        self.debugger = debugger
+        self.cpu = debugger.cpu
+        self.previous = previous
+
+    def read(self, address):
+        if self.previous is None:
+            return self.cpu.ram[address]
+        return self.previous.read(address)
+
+    def write(self, address, value):
+        old = self.read(address)
+        if self.previous is None:
+            self.cpu.ram[address] = value
+        else:
+            self.previous.write(address, value)
+        self.debugger.hits.append(f"write to {address:02X}: {old:02X} -> {value:02X}")
+
+
+class Debugger:
+    """
+    Stops a CPU at breakpoints (PC, optionally with a condition), when a
+    watched address is written or a watched register changes, or when a stop
+    condition becomes true. Conditions are callables taking the CPU.
+    Stop conditions are edge-triggered: one that already holds when `run`
+    starts only stops it after going false and then true again.
+
+    `run` executes the checked loop until something stops it and returns the
+    reason ("halted" once the program halts); `reason` keeps the last one.
+    Memory watchpoints are bus devices (see bus.py), so they catch every
+    write (ST, PUSH, CALL, interrupts) without touching the fast loop.
+    """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        # pc -> condition (None for always)
+        self.breakpoints = {}
+        # address -> Watch mapped over it
+        self.memoryWatches = {}
+        self.registerWatches = set()
+        # (description, condition)
+        self.conditions = []
+        # memory watch hits since the last instruction
+        self.hits = []
+        self.reason = None
+
+    def active(self):
+        """True if anything is set that needs the checked loop."""
+        return bool(self.breakpoints or self.memoryWatches or self.registerWatches
+                    or self.conditions)
+
+    def break_at(self, pc, condition=None):
+        self.breakpoints[pc & 0xFF] = condition
+
+    def clear_break(self, pc):
+        self.breakpoints.pop(pc & 0xFF, None)
+
+    def watch_memory(self, address):
+        if address not in self.memoryWatches:
+            bus = self.cpu.bus
+            watch = Watch(self, bus.device(address))
+            self.memoryWatches[address] = bus.map(watch, address)
+
+    def unwatch_memory(self, address):
+        watch = self.memoryWatches.pop(address, None)
+        if watch is not None:
+            bus = self.cpu.bus
+            bus.unmap(address)
+            if watch.previous is not None:
+                bus.map(watch.previous, address)
+
+    def watch_register(self, register):
+        self.registerWatches.add(register)
+
+    def unwatch_register(self, register):
+        self.registerWatches.discard(register)
+
+    def stop_when(self, condition, description=None):
+        self.conditions.append((description or repr(condition), condition))
+
+    def clear(self):
+        """Remove every breakpoint, watchpoint and stop condition."""
+        self.breakpoints.clear()
+        for address in list(self.memoryWatches):
+            self.unwatch_memory(address)
+        self.registerWatches.clear()
+        self.conditions.clear()
+
+    def run(self, limit=None):
+        """
+        Run the checked loop until a stop, HLT, or `limit` instructions.
+        A breakpoint on the instruction the CPU is stopped at doesn't fire again
+        straight away, so `run` after a stop always makes progress.
+        """
+        cpu = self.cpu
+        reg = cpu.reg
+        IM = cpu.IM
+        IS = cpu.IS
+        breakpoints = self.breakpoints
+        registers = sorted(self.registerWatches)
+        conditions = self.conditions
+        hits = self.hits
+        hits.clear()
+        resumePc = cpu.pc
+        # last value of each stop condition, so only a false -> true change stops
+        holding = [bool(condition(cpu)) for _, condition in conditions]
+        count = 0
+        reason = None
+        if cpu.halted:
+            self.reason = "halted"
+            return self.reason
+        cpu.canRun = True
+
+        try:
+            while cpu.canRun:
+                if cpu.cycles >= cpu.deadline:
+                    cpu.scheduler.dispatch()
+                if reg[IM] & reg[IS] and cpu.canInterrupt:
+                    cpu.interrupt()
+
+                pc = cpu.pc
+                if pc in breakpoints and not (count == 0 and pc == resumePc):
+                    condition = breakpoints[pc]
+                    if condition is None or condition(cpu):
+                        reason = f"breakpoint at {pc:02X}"
+                        break
+                if limit is not None and count >= limit:
+                    reason = "step"
+                    break
+
+                # decoded afresh every time: no fused or fast-forwarded sequences to step over
+                opcode = cpu.ram[pc]
+                operation = cpu.getOperation(opcode)
+                length = (opcode >> 6) + 1
+                before = [reg[r] for r in registers]
+                if length == 2:
+                    operation(cpu.ram[(pc + 1) & 0xFF])
+                elif length == 3:
+                    operation(cpu.ram[(pc + 1) & 0xFF], cpu.ram[(pc + 2) & 0xFF])
+                else:
+                    operation()
+                cpu.pc = (cpu.pc + length) & 0xFF
+                cpu.cycles += 1
+                count += 1
+
+                if hits:
+                    reason = hits[0]
+                    break
+                changed = [f"R{r}: {old:02X} -> {reg[r]:02X}"
+                           for r, old in zip(registers, before) if reg[r] != old]
+                if changed:
+                    reason = ", ".join(changed)
+                    break
+                for i, (description, condition) in enumerate(conditions):
+                    now = bool(condition(cpu))
+                    if now and not holding[i] and reason is None:
+                        reason = f"condition {description}"
+                    holding[i] = now
+                if reason is not None:
+                    break
+        finally:
+            cpu.output.flush()
+
+        if cpu.halted:
+            reason = "halted"
+        self.reason = reason
+        return reason
+
+    def step(self, count=1):
+        """Run `count` instructions (stopping early for breakpoints and watchpoints)."""
+        return self.run(count)
+
+
+def condition(expression):
+    """
+    Compile a Python expression over the CPU state into a condition: `pc`,
+    `fl`, `reg`, `ram`, `R0`-`R7` and the flags `E`, `L`, `G` are available.
+    """
+    code = compile(expression, "<condition>", "eval")
+
+    def check(cpu):
+        names = {"pc": cpu.pc, "fl": cpu.fl, "reg": cpu.reg, "ram": cpu.ram,
+                 "E": cpu.fl & cpu.FL_E, "L": cpu.fl & cpu.FL_L, "G": cpu.fl & cpu.FL_G}
+        names.update((f"R{r}", value) for r, value in enumerate(cpu.reg))
+        return eval(code, {}, names)
+
+    return check
+
+
+class Shell(cmd.Cmd):
+    """Command-line front end to a Debugger."""
+
+    prompt = "(ls8) "
+
+    def __init__(self, cpu, stdout=None):
+        super().__init__(stdout=stdout)
+        self.cpu = cpu
+        self.debugger = cpu.debug()
+        self.names = mnemonics()
+        self.intro = "LS-8 debugger. Type help for commands.\n" + self.where()
+
+    def address(self, text):
+        """A label from the symbol table, or a hex address."""
+        for label, value in self.cpu.symbols.items():
+            if label.lower() == text.lower():
+                return value
+        return int(text, 16) & 0xFF
+
+    def register(self, text):
+        if len(text) == 2 and text[0] in "rR" and text[1] in "01234567":
+            return int(text[1])
+        return None
+
+    def where(self):
+        cpu = self.cpu
+        pc = cpu.pc
+        ram = cpu.ram
+        instruction = describe(ram[pc], ram[(pc + 1) & 0xFF], ram[(pc + 2) & 0xFF], self.names)
+        label = next((name for name, value in cpu.symbols.items() if value == pc), None)
+        return f"{pc:02X}: {instruction}" + (f"    ; {label}" if label else "")
+
+    def show(self, reason):
+        if reason is not None:
+            self.stdout.write(f"stopped: {reason}\n")
+        if not self.cpu.halted:
+            self.stdout.write(self.where() + "\n")
+
+    def do_break(self, arg):
+        """break ADDR [if EXPR]  stop when the PC reaches ADDR (a label or hex), optionally only if EXPR holds"""
+        where, _, expression = arg.partition(" if ")
+        if not where.strip():
+            for pc, check in sorted(self.debugger.breakpoints.items()):
+                self.stdout.write(f"{pc:02X}{' (conditional)' if check else ''}\n")
+            return
+        self.debugger.break_at(self.address(where.strip()),
+                               condition(expression) if expression.strip() else None)
+
+    def do_delete(self, arg):
+        """delete ADDR  remove the breakpoint at ADDR; delete with no argument clears everything"""
+        if arg.strip():
+            self.debugger.clear_break(self.address(arg.strip()))
+        else:
+            self.debugger.clear()
+
+    def do_watch(self, arg):
+        """watch ADDR | watch Rn  stop when ADDR is written or register Rn changes"""
+        register = self.register(arg.strip())
+        if register is not None:
+            self.debugger.watch_register(register)
+        else:
+            self.debugger.watch_memory(self.address(arg.strip()))
+
+    def do_unwatch(self, arg):
+        """unwatch ADDR | unwatch Rn  remove a watchpoint"""
+        register = self.register(arg.strip())
+        if register is not None:
+            self.debugger.unwatch_register(register)
+        else:
+            self.debugger.unwatch_memory(self.address(arg.strip()))
+
+    def do_stop(self, arg):
+        """stop EXPR  stop as soon as EXPR becomes true, e.g. `stop R0 == 5 and E`"""
+        self.debugger.stop_when(condition(arg), arg.strip())
+
+    def do_step(self, arg):
+        """step [N]  run N instructions (1 by default)"""
+        self.show(self.debugger.step(int(arg or 1)))
+
+    def do_continue(self, arg):
+        """continue  run until a breakpoint, watchpoint, condition or HLT"""
+        if self.debugger.active():
+            self.show(self.debugger.run())
+        else:
+            # nothing set: the normal fast loop
+            self.cpu.run()
+            self.show("halted" if self.cpu.halted else None)
+
+    do_c = do_continue
+    do_s = do_step
+
+    def do_regs(self, arg):
+        """regs  show the registers, PC, FL and cycle count"""
+        cpu = self.cpu
+        registers = " ".join(f"R{i}={value:02X}" for i, value in enumerate(cpu.reg))
+        self.stdout.write(f"{registers} PC={cpu.pc:02X} FL={cpu.fl:08b} cycles={cpu.cycles}\n")
+
+    def do_mem(self, arg):
+        """mem [ADDR [N]]  dump N bytes of RAM from ADDR (16 from the PC by default)"""
+        args = arg.split()
+        start = self.address(args[0]) if args else self.cpu.pc
+        count = int(args[1]) if len(args) > 1 else 16
+        ram = self.cpu.ram
+        for row in range(start, start + count, 16):
+            data = " ".join(f"{ram[address & 0xFF]:02X}"
+                            for address in range(row, min(row + 16, start + count)))
+            self.stdout.write(f"{row & 0xFF:02X}: {data}\n")
+
+    def do_set(self, arg):
+        """set Rn VALUE | set ADDR VALUE  change a register or a byte of RAM (hex)"""
+        target, value = arg.split()
+        register = self.register(target)
+        if register is not None:
+            self.cpu.reg[register] = int(value, 16) & 0xFF
+        else:
+            self.cpu.ram_write(self.address(target), int(value, 16))
+
+    def do_quit(self, arg):
+        """quit  leave the debugger"""
+        return True
+
+    do_q = do_quit
+    do_EOF = do_quit
+
+    def onecmd(self, line):
+        try:
+            return super().onecmd(line)
+        except (ValueError, SyntaxError, IndexError) as e:
+            self.stdout.write(f"error: {e}\n")
+            return False
+
+
+def main(argv):
+    from cpu import CPU
+
+    if len(argv) != 2:
+        print("usage: debugger.py program")
+        return 1
+    cpu = CPU()
+    cpu.load(argv[1])
+    Shell(cpu).cmdloop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,157 @@
+"""Devices attached to the LS-8 CPU."""
+
+import sys
+import time
+
+
+class BufferedOutput:
+    """
+    Output device for PRN/PRA that batches writes to a stream.
+
+    Output is flushed when `size` characters are pending, when `interval`
+    seconds have passed since the last flush (None disables that), when the
+    CPU halts, when `run` returns and before the scheduler sleeps in real-time
+    mode.
+    With `stream` left as None, output goes to whatever sys.stdout is at flush time.
+    """
+
+    def __init__(self, stream=None, size=8192, interval=0.1):
+        self.stream = stream
+        self.size = size
+        self.interval = interval
+        self.parts = []
+        self.pending = 0
+        self.deadline = None
+
+    def write(self, text):
+        self.parts.append(text)
+        self.pending += len(text)
+        if self.pending >= self.size:
+            self.flush()
+        elif self.interval is not None:
+            now = time.monotonic()
+            if self.deadline is None:
+                self.deadline = now + self.interval
+            elif now >= self.deadline:
+                self.flush()
+
+    def flush(self):
+        if self.parts:
+            stream = self.stream if self.stream is not None else sys.stdout
+            stream.write("".join(self.parts))
+            stream.flush()
+            self.parts.clear()
+            self.pending = 0
+        self.deadline = None
+
+
+class MemoryOutput:
+    """
+    Output device that keeps everything in memory, for batch and test runs.
+    With a `limit`, only the first `limit` characters are kept and
+    `truncated` is set once any are dropped.
+    """
+
+    def __init__(self, limit=None):
+        self.parts = []
+        # characters that can still be kept (None for no limit)
+        self.remaining = limit
+        self.truncated = False
+
+    def write(self, text):
+        if self.remaining is not None:
+            if len(text) > self.remaining:
+                text = text[:self.remaining]
+                self.truncated = True
+            self.remaining -= len(text)
+        self.parts.append(text)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return "".join(self.parts)
+
+
+"""
+Memory-mapped devices
+
+Attached to address ranges with `cpu.bus.map(device, start, end)` (see bus.py).
+The base class keeps its bytes in RAM, so snapshots, dumps and the static
+analysis see them like any other memory; subclasses add side effects.
+"""
+
+
+class Device:
+    """A memory-mapped device whose addresses behave like RAM."""
+
+    __slots__ = ("cpu",)
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+
+    def read(self, address):
+        return self.cpu.ram[address]
+
+    def write(self, address, value):
+        self.cpu.ram[address] = value
+
+
+class KeyboardPort(Device):
+    """KEY_PRESSED (0xF4): holds the most recent key; a key press raises I1."""
+
+    __slots__ = ()
+
+    INTERRUPT = 1
+
+    def press(self, key):
+        """Store `key` and raise the keyboard interrupt."""
+        cpu = self.cpu
+        cpu.ram[cpu.KEY_PRESSED] = key & 0xFF
+        cpu.invalidate(cpu.KEY_PRESSED)
+        cpu.raiseInterrupt(self.INTERRUPT)
+
+    def pending(self):
+        """True while the last key press hasn't been serviced."""
+        cpu = self.cpu
+        return bool(cpu.reg[cpu.IS] & (1 << self.INTERRUPT))
+
+
+class OutputPort(Device):
+    """A write-only character port: every byte written goes to the CPU's output as a character."""
+
+    __slots__ = ()
+
+    def read(self, address):
+        return 0
+
+    def write(self, address, value):
+        self.cpu.output.write(chr(value))
+
+
+class Timer(Device):
+    """
+    Raises I0 every `interval` cycles (one second of emulated time by default).
+    When mapped, reading its address gives the number of ticks so far (mod 256)
+    and writing sets it.
+    """
+
+    __slots__ = ("ticks",)
+
+    INTERRUPT = 0
+
+    def __init__(self, cpu, interval=None):
+        super().__init__(cpu)
+        self.ticks = 0
+        scheduler = cpu.scheduler
+        scheduler.every(interval or scheduler.cyclesPerSecond, self)
+
+    def __call__(self, cpu):
+        self.ticks = (self.ticks + 1) & 0xFF
+        cpu.raiseInterrupt(self.INTERRUPT)
+
+    def read(self, address):
+        return self.ticks
+
+    def write(self, address, value):
+        self.ticks = value
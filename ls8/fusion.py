@@ -0,0 +1,147 @@
+"""Superinstruction fusion for the LS-8 CPU."""
+
+from collections import Counter, defaultdict
+
+LDI  = 0b10000010
+PUSH = 0b01000101
+CALL = 0b01010000
+JEQ  = 0b01010101
+JNE  = 0b01010110
+INC  = 0b01100101
+DEC  = 0b01100110
+CMP  = 0b10100111
+
+NAMES = {LDI: "LDI", PUSH: "PUSH", CALL: "CALL", JEQ: "JEQ", JNE: "JNE",
+         INC: "INC", DEC: "DEC", CMP: "CMP"}
+
+# Bytes covered by the longest fused sequence (LDI + CMP + JEQ/JNE)
+SPAN = 8
+
+
+class Fusion:
+    """
+    Recognises common instruction sequences when they are decoded and replaces
+    the pre-decoded entry of the first instruction with one fused handler:
+
+    * INC/DEC r; CMP a,b; JEQ/JNE j  (counter loops)
+    * LDI r,i; CMP a,b; JEQ/JNE j    (loop tails and tests against a constant)
+    * PUSH r; CALL s                 (argument or register saved around a call)
+
+    A fused entry has length 0: its handler sets the PC itself and returns the
+    number of instructions it retired beyond the first, which `CPU.run` adds
+    to the cycle count. Registers, flags, RAM and the PC end up exactly as if
+    the instructions had run one at a time. Jumping into the middle of a
+    sequence runs the plain instructions from there.
+
+    `stats` counts how often each fused form ran and `sites` holds the
+    addresses where it was fused.
+    """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.stats = Counter()
+        self.sites = defaultdict(set)
+
+    def fuse(self, pc):
+        """Fused entry for the sequence starting at `pc`, or None."""
+        ram = self.cpu.ram
+        opcode = ram[pc]
+        # with loop fast-forward on, JNE keeps its own entry so loops are still spotted
+        jumps = (JEQ,) if self.cpu.loops is not None else (JEQ, JNE)
+
+        if opcode == INC or opcode == DEC:
+            if ram[(pc + 2) & 0xFF] == CMP and ram[(pc + 5) & 0xFF] in jumps:
+                return self.compare_branch(pc, opcode, 2)
+
+        elif opcode == LDI:
+            if ram[(pc + 3) & 0xFF] == CMP and ram[(pc + 6) & 0xFF] in jumps:
+                return self.compare_branch(pc, opcode, 3)
+
+        elif opcode == PUSH:
+            if ram[(pc + 2) & 0xFF] == CALL:
+                return self.push_call(pc)
+
+        return None
+
+    def compare_branch(self, pc, opcode, length):
+        """INC/DEC/LDI, then CMP, then JEQ/JNE."""
+        cpu = self.cpu
+        reg = cpu.reg
+        ram = cpu.ram
+        stats = self.stats
+
+        r = ram[(pc + 1) & 0xFF]
+        value = ram[(pc + 2) & 0xFF]
+        a = ram[(pc + length + 1) & 0xFF]
+        b = ram[(pc + length + 2) & 0xFF]
+        jump = ram[(pc + length + 3) & 0xFF]
+        j = ram[(pc + length + 4) & 0xFF]
+        jumpPc = (pc + length + 3) & 0xFF
+        nextPc = (pc + length + 5) & 0xFF
+        onEqual = jump == JEQ
+        step = {INC: 1, DEC: -1}.get(opcode)
+        FL_E, FL_L, FL_G = cpu.FL_E, cpu.FL_L, cpu.FL_G
+
+        name = f"{NAMES[opcode]}+CMP+{NAMES[jump]}"
+        self.sites[name].add(pc)
+
+        def fused():
+            stats[name] += 1
+            if step is None:
+                reg[r] = value
+            else:
+                reg[r] = (reg[r] + step) & 0xFF
+            valA = reg[a]
+            valB = reg[b]
+            cpu.fl = FL_E if valA == valB else FL_L if valA < valB else FL_G
+            if (valA == valB) == onEqual:
+                target = reg[j]
+                if target == jumpPc:
+                    cpu.spin()
+                cpu.pc = target
+            else:
+                cpu.pc = nextPc
+            return 2
+
+        return (fused, None, None, 0)
+
+    def push_call(self, pc):
+        """PUSH r, then CALL s."""
+        cpu = self.cpu
+        reg = cpu.reg
+        ram = cpu.ram
+        decoded = cpu.decoded
+        stats = self.stats
+        SP = cpu.SP
+
+        r = ram[(pc + 1) & 0xFF]
+        s = ram[(pc + 3) & 0xFF]
+        callPc = (pc + 2) & 0xFF
+        returnPc = (pc + 4) & 0xFF
+
+        name = "PUSH+CALL"
+        self.sites[name].add(pc)
+
+        def fused():
+            reg[SP] = (reg[SP] - 1) & 0xFF
+            cpu.ram_write(reg[SP], reg[r])
+            if decoded[pc] is not entry:
+                # the push overwrote this sequence: let the CALL be decoded again
+                cpu.pc = callPc
+                return 0
+            stats[name] += 1
+            target = reg[s]
+            reg[SP] = (reg[SP] - 1) & 0xFF
+            cpu.ram_write(reg[SP], returnPc)
+            cpu.pc = target
+            return 1
+
+        entry = (fused, None, None, 0)
+        return entry
+
+    def report(self):
+        """Text table of the fused forms, most frequently run first."""
+        lines = [f"{'fused form':<16} {'sites':>6} {'runs':>10}"]
+        for name in sorted(self.sites, key=self.stats.__getitem__, reverse=True):
+            lines.append(f"{name:<16} {len(self.sites[name]):>6} {self.stats[name]:>10}")
+        return "\n".join(lines) + "\n"
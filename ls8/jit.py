@@ -0,0 +1,200 @@
+"""Basic-block JIT for the LS-8 CPU."""
+
+# Opcodes the JIT generates inline code for
+HLT  = 0b00000001
+RET  = 0b00010001
+IRET = 0b00010011
+LDI  = 0b10000010
+ADDI = 0b10000110
+ST   = 0b10000100
+PUSH = 0b01000101
+POP  = 0b01000110
+CALL = 0b01010000
+INT  = 0b01010010
+JMP  = 0b01010100
+JEQ  = 0b01010101
+JNE  = 0b01010110
+ADD  = 0b10100000
+SUB  = 0b10100001
+MUL  = 0b10100010
+INC  = 0b01100101
+DEC  = 0b01100110
+CMP  = 0b10100111
+AND  = 0b10101000
+NOT  = 0b01101001
+OR   = 0b10101010
+XOR  = 0b10101011
+
+# Register-to-register ALU operations that compile to a single expression
+BINARY_OPS = {
+    ADD: "+",
+    SUB: "-",
+    MUL: "*",
+    AND: "&",
+    OR: "|",
+    XOR: "^",
+}
+
+# Opcodes that end a basic block. ST and PUSH end one too, because they may
+# write into code that is already compiled.
+BLOCK_END = {HLT, RET, IRET, CALL, INT, JMP, JEQ, JNE, ST, PUSH}
+
+# Longest block compiled in one go
+MAX_BLOCK = 64
+
+
+class JIT:
+    """
+    Finds basic blocks in the loaded program, compiles each one into a Python
+    function and caches it by entry PC.
+
+    A compiled block is called as `block(cpu, reg, ram)` and returns the PC
+    of the next block to run.
+    """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        # Compiled blocks indexed by entry PC
+        self.blocks = [None] * 256
+        # address -> entry PCs of the blocks whose code covers that address
+        self.owners = {}
+
+    def reset(self):
+        """Drop every compiled block."""
+        self.blocks[:] = [None] * 256
+        self.owners.clear()
+
+    def invalidate(self, mar):
+        """Drop the compiled blocks that cover address `mar`."""
+        for entry in self.owners.pop(mar, ()):
+            self.blocks[entry] = None
+
+    def source(self, pc):
+        """
+        Generate Python source for the basic block starting at `pc`.
+        Returns the source, the handlers it calls and the addresses it covers.
+        """
+        cpu = self.cpu
+        ram = cpu.ram
+        lines = ["def block(cpu, reg, ram):"]
+        handlers = {}
+        start = pc
+        count = 0
+
+        for _ in range(MAX_BLOCK):
+            count += 1
+            op = ram[pc]
+            a = ram[(pc + 1) & 0xFF]
+            b = ram[(pc + 2) & 0xFF]
+            length = (op >> 6) + 1
+            next_pc = (pc + length) & 0xFF
+
+            if op == LDI:
+                lines.append(f"    reg[{a}] = {b}")
+            elif op == ADDI:
+                lines.append(f"    reg[{a}] = (reg[{a}] + {b}) & 0xFF")
+            elif op in BINARY_OPS:
+                lines.append(f"    reg[{a}] = (reg[{a}] {BINARY_OPS[op]} reg[{b}]) & 0xFF")
+            elif op == INC:
+                lines.append(f"    reg[{a}] = (reg[{a}] + 1) & 0xFF")
+            elif op == DEC:
+                lines.append(f"    reg[{a}] = (reg[{a}] - 1) & 0xFF")
+            elif op == NOT:
+                lines.append(f"    reg[{a}] = ~reg[{a}] & 0xFF")
+            elif op == CMP:
+                lines.append(f"    x = reg[{a}]; y = reg[{b}]")
+                lines.append(f"    cpu.fl = {cpu.FL_E} if x == y else {cpu.FL_L} if x < y else {cpu.FL_G}")
+            elif op == POP:
+                # the handler raises on an empty stack
+                lines.append(f"    cpu.POP({a})")
+            elif op == PUSH:
+                lines.append(f"    cpu.pushValue(reg[{a}])")
+                lines.append(f"    return {next_pc}")
+            elif op == ST:
+                lines.append(f"    cpu.ram_write(reg[{a}], reg[{b}])")
+                lines.append(f"    return {next_pc}")
+            elif op == JMP:
+                lines.append(f"    target = reg[{a}]")
+                # jumping to itself: idle until the next scheduled event
+                lines.append(f"    if target == {pc}: cpu.spin()")
+                lines.append("    return target")
+            elif op == JEQ:
+                lines.append(f"    return reg[{a}] if cpu.fl & {cpu.FL_E} else {next_pc}")
+            elif op == JNE:
+                lines.append(f"    return {next_pc} if cpu.fl & {cpu.FL_E} else reg[{a}]")
+            elif op == CALL:
+                lines.append(f"    target = reg[{a}]")
+                lines.append(f"    cpu.pushValue({next_pc})")
+                lines.append("    return target")
+            elif op == RET:
+                lines.append("    return cpu.popValue()")
+            elif op == INT:
+                lines.append(f"    cpu.raiseInterrupt(reg[{a}] & 0b111)")
+                lines.append(f"    return {next_pc}")
+            elif op == IRET:
+                lines.append("    cpu.IRET()")
+                lines.append("    return cpu.pc + 1")
+            elif op == HLT:
+                lines.append("    cpu.HLT()")
+                lines.append(f"    return {next_pc}")
+            elif op not in cpu.branchtable:
+                # raise "Unsupported operation" only if execution gets here
+                lines.append(f"    cpu.getOperation({op})")
+                break
+            else:
+                # Everything else (PRN, PRA, LD, DIV, MOD, ...) goes through the interpreter's handler
+                name = f"h{pc}"
+                handlers[name] = cpu.getOperation(op)
+                args = (a, b)[:length - 1]
+                lines.append(f"    {name}({', '.join(map(str, args))})")
+                # a handler may halt the CPU (e.g. divide by zero)
+                lines.append(f"    if not cpu.canRun: return {next_pc}")
+
+            if op in BLOCK_END:
+                break
+            if next_pc < pc:
+                # ran off the top of RAM
+                lines.append(f"    return {next_pc}")
+                break
+            pc = next_pc
+        else:
+            lines.append(f"    return {pc}")
+
+        # account for the whole block's instructions up front
+        lines.insert(1, f"    cpu.cycles += {count}")
+        covered = [(start + i) & 0xFF for i in range(((pc - start) & 0xFF) + length)]
+        return "\n".join(lines) + "\n", handlers, covered
+
+    def compile(self, pc):
+        """Compile the block starting at `pc` and cache it."""
+        source, namespace, covered = self.source(pc)
+        exec(compile(source, f"<ls8 block {pc:02X}>", "exec"), namespace)
+        block = namespace["block"]
+        self.blocks[pc] = block
+        for address in covered:
+            self.owners.setdefault(address, set()).add(pc)
+        return block
+
+    def run(self):
+        """Run the CPU one compiled block at a time until HLT."""
+        cpu = self.cpu
+        reg = cpu.reg
+        ram = cpu.ram
+        blocks = self.blocks
+        compile_block = self.compile
+        IM = cpu.IM
+        IS = cpu.IS
+        pc = cpu.pc
+        try:
+            while cpu.canRun:
+                # scheduled events and interrupts are taken between blocks
+                if cpu.cycles >= cpu.deadline:
+                    cpu.scheduler.dispatch()
+                if reg[IM] & reg[IS] and cpu.canInterrupt:
+                    cpu.pc = pc
+                    cpu.interrupt()
+                    pc = cpu.pc
+                pc = (blocks[pc] or compile_block(pc))(cpu, reg, ram)
+        finally:
+            # on an exception, the start of the block that raised
+            cpu.pc = pc
@@ -0,0 +1,133 @@
+"""Non-blocking asyncio keyboard device for the LS-8 CPU."""
+
+import asyncio
+import os
+import stat
+import sys
+
+from devices import KeyboardPort
+
+# Keyboard interrupt (I1)
+KEYBOARD_INTERRUPT = KeyboardPort.INTERRUPT
+
+
+class Keyboard:
+    """
+    Reads key presses from an async stream without blocking and feeds them to
+    the CPU at instruction boundaries: each key is stored at KEY_PRESSED (0xF4)
+    and raises the keyboard interrupt.
+
+    The CPU runs in slices of `slice` instructions between event-loop turns.
+    When the program is spinning, waiting for input, the keyboard awaits the
+    next key (or, in real time, the next scheduled event) instead of
+    busy-waiting. In fast-forward mode a spinning program that another
+    interrupt can wake keeps running slices, which skip ahead to the next event.
+    """
+
+    def __init__(self, cpu, slice=10_000):
+        self.cpu = cpu
+        self.slice = slice
+        self.queue = asyncio.Queue()
+        self.pressed = asyncio.Event()
+        self.closed = False
+        # KEY_PRESSED, mapped on the CPU's bus
+        self.port = cpu.bus.map(KeyboardPort(cpu), cpu.KEY_PRESSED)
+
+    async def feed(self, reader):
+        """Queue every byte read from `reader` (an asyncio.StreamReader or similar)."""
+        while True:
+            data = await reader.read(64)
+            if not data:
+                break
+            for key in data:
+                self.queue.put_nowait(key)
+            self.pressed.set()
+        self.closed = True
+        self.pressed.set()
+
+    def deliver(self):
+        """Hand the next queued key to the CPU, unless the previous one is still pending."""
+        if self.queue.empty() or self.port.pending():
+            return
+        self.port.press(self.queue.get_nowait())
+
+    async def run(self, reader):
+        """Run the CPU until it halts, reading keys from `reader` in the background."""
+        cpu = self.cpu
+        feeder = asyncio.ensure_future(self.feed(reader))
+        try:
+            while True:
+                self.deliver()
+                cpu.spinning = False
+                if not cpu.run_slice(self.slice):
+                    break
+
+                if cpu.spinning and self.queue.empty():
+                    # the program is waiting: sleep until a key arrives or the next event is due
+                    otherInterrupts = cpu.reg[cpu.IM] & ~(1 << KEYBOARD_INTERRUPT)
+                    if self.closed and not otherInterrupts:
+                        # no more input will come and no other interrupt can wake the program
+                        break
+                    if cpu.scheduler.realtime:
+                        timeout = cpu.scheduler.secondsUntilNext()
+                    elif otherInterrupts:
+                        # fast-forward: the next slice jumps to the next event, no need to wait
+                        await asyncio.sleep(0)
+                        continue
+                    else:
+                        # only a key can wake the program
+                        timeout = None
+                    self.pressed.clear()
+                    try:
+                        await asyncio.wait_for(self.pressed.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    # let the reader run between slices
+                    await asyncio.sleep(0)
+        finally:
+            feeder.cancel()
+            cpu.output.flush()
+
+
+class FileReader:
+    """
+    Reads a file the event loop can't watch (a regular file, /dev/null) on a
+    worker thread, with the same `read` as an asyncio.StreamReader.
+    """
+
+    def __init__(self, file):
+        self.fd = file.fileno()
+
+    async def read(self, n):
+        return await asyncio.get_running_loop().run_in_executor(None, os.read, self.fd, n)
+
+
+async def stdin_reader():
+    """Wrap stdin in an asyncio.StreamReader (a FileReader unless it is a pipe, socket or terminal)."""
+    mode = os.fstat(sys.stdin.fileno()).st_mode
+    if not (stat.S_ISFIFO(mode) or stat.S_ISSOCK(mode) or sys.stdin.isatty()):
+        return FileReader(sys.stdin)
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    return reader
+
+
+async def run_with_stdin(cpu):
+    """Run `cpu` with the terminal as its keyboard, one key at a time (no line buffering)."""
+    reader = await stdin_reader()
+    keyboard = Keyboard(cpu)
+    if not sys.stdin.isatty():
+        await keyboard.run(reader)
+        return
+
+    import termios
+    import tty
+    fd = sys.stdin.fileno()
+    saved = termios.tcgetattr(fd)
+    tty.setcbreak(fd)
+    try:
+        await keyboard.run(reader)
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, saved)
@@ -0,0 +1,235 @@
+"""Counted-loop fast-forward for the LS-8 CPU."""
+
+from math import gcd
+
+NOP  = 0b00000000
+LDI  = 0b10000010
+ADDI = 0b10000110
+INC  = 0b01100101
+DEC  = 0b01100110
+ADD  = 0b10100000
+SUB  = 0b10100001
+CMP  = 0b10100111
+JNE  = 0b01010110
+
+# IM, IS and SP: a loop body that touches them is never fast-forwarded
+RESERVED = (5, 6, 7)
+
+
+class LoopAccelerator:
+    """
+    Spots counted loops when their closing JNE jumps backwards and runs all
+    remaining iterations in one step:
+
+        Loop:
+            ...             ; LDI, INC, DEC, ADDI, NOP, and ADD/SUB of a
+                            ; loop-invariant register
+            CMP Ra,Rb       ; one side steps by a constant, the other is invariant
+            JNE Rj          ; back to Loop
+
+    Each register's change per iteration is worked out symbolically (set to
+    a constant, or stepped by a constant), the number of iterations left
+    comes from solving `counter + m * step == limit (mod 256)`, and the final
+    registers and flags are set directly. Anything else in the body (memory,
+    stack, I/O, other jumps) makes the loop run normally.
+
+    The JNE's pre-decoded entry is replaced by a length-0 handler that returns
+    the instructions it skipped, so the cycle count is the same as without
+    fast-forwarding. Loops are left alone while interrupts are enabled (IM is
+    non-zero), because an interrupt would have been serviced mid-loop.
+
+    A loop that can't be fast-forwarded gets the plain JNE entry back, so it
+    runs at normal speed; a write into its body or JNE (see `invalidate`)
+    drops that entry and the loop is looked at again.
+
+    `stats` counts loops fast-forwarded and iterations skipped.
+    """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        # address -> JNEs given back their plain entry because of the loop body there
+        self.owners = {}
+        self.stats = {"loops": 0, "iterations": 0}
+
+    def entry(self, pc):
+        """Pre-decoded entry for the JNE at `pc`."""
+        cpu = self.cpu
+        reg = cpu.reg
+        j = cpu.ram[(pc + 1) & 0xFF]
+        nextPc = (pc + 2) & 0xFF
+        IM = cpu.IM
+        FL_E = cpu.FL_E
+
+        def jne():
+            if cpu.fl & FL_E:
+                cpu.pc = nextPc
+                return 0
+            target = reg[j]
+            if target < pc and not reg[IM]:
+                skipped = self.fast_forward(target, pc, j)
+                if skipped is not None:
+                    # fast_forward has set the PC
+                    return skipped
+            if target == pc:
+                cpu.spin()
+            cpu.pc = target
+            return 0
+
+        return (jne, None, None, 0)
+
+    def analyze(self, start, end, j):
+        """
+        Per-iteration effect of the loop body from `start` up to the JNE at `end`.
+        Returns (instructions per iteration, {register: ("const" | "add", value)},
+        counter register, limit register), or None if it isn't a counted loop.
+        """
+        ram = self.cpu.ram
+        reg = self.cpu.reg
+        effects = {}
+        compare = None
+        count = 1
+        pc = start
+
+        # registers written anywhere in the body
+        written = set()
+        scan = start
+        while scan < end:
+            op = ram[scan]
+            if op in (LDI, ADDI, INC, DEC, ADD, SUB):
+                written.add(ram[scan + 1])
+            scan += (op >> 6) + 1
+
+        while pc < end:
+            op = ram[pc]
+            length = (op >> 6) + 1
+            if pc + length > end:
+                return None
+            a = ram[pc + 1] if length > 1 else None
+            b = ram[pc + 2] if length > 2 else None
+            if a is not None and (a > 7 or (a in RESERVED)):
+                return None
+            count += 1
+
+            if op == NOP:
+                pass
+            elif op == CMP:
+                # must be the instruction right before the JNE
+                if pc + 3 != end or b > 7 or b in RESERVED:
+                    return None
+                compare = (a, b)
+            elif op == LDI:
+                effects[a] = ("const", b)
+            elif op in (INC, DEC, ADDI):
+                step = 1 if op == INC else -1 if op == DEC else b
+                kind, value = effects.get(a, ("add", 0))
+                effects[a] = (kind, value + step)
+            elif op in (ADD, SUB):
+                if b > 7 or b in RESERVED or b == a:
+                    return None
+                source = effects.get(b)
+                if source is None and b not in written:
+                    # loop invariant
+                    delta = reg[b]
+                elif source is not None and source[0] == "const":
+                    delta = source[1]
+                else:
+                    return None
+                if op == SUB:
+                    delta = -delta
+                kind, value = effects.get(a, ("add", 0))
+                effects[a] = (kind, value + delta)
+            else:
+                return None
+            pc += length
+
+        if compare is None or pc != end:
+            return None
+
+        # the jump register has to keep pointing at the loop
+        kind, value = effects.get(j, ("add", 0))
+        if (kind == "add" and value & 0xFF) or (kind == "const" and value != start):
+            return None
+
+        a, b = compare
+        for counter, limit in ((a, b), (b, a)):
+            kind, step = effects.get(counter, ("add", 0))
+            limitKind, limitStep = effects.get(limit, ("add", 0))
+            if kind == "add" and step & 0xFF and (limitKind == "const" or not limitStep & 0xFF):
+                return count, effects, counter, limit
+        return None
+
+    def reject(self, start, end):
+        """Give the JNE at `end` its plain entry, until its loop body is written to."""
+        cpu = self.cpu
+        cpu.decoded[end] = cpu.plain_entry(end)
+        for address in range(start, end + 2):
+            self.owners.setdefault(address, set()).add(end)
+
+    def invalidate(self, mar):
+        """`mar` was written: JNEs rejected because of the code there get analyzed again."""
+        pcs = self.owners.pop(mar, None)
+        if pcs is not None:
+            decoded = self.cpu.decoded
+            for pc in pcs:
+                decoded[pc] = None
+
+    def fast_forward(self, start, end, j):
+        """
+        Run the rest of the loop from `start` to the JNE at `end` in one step,
+        and set the PC after it. Returns the instructions skipped, or None to
+        run the loop normally.
+
+        Iterations that would run past the next scheduled event (`cpu.deadline`,
+        e.g. a timer tick or a run_slice pause) are left to run normally, so
+        the event still comes at the right cycle.
+        """
+        cpu = self.cpu
+        reg = cpu.reg
+        if not cpu.canRun:
+            # paused (or halted) by an event: the run stops after this instruction
+            return None
+
+        loop = self.analyze(start, end, j)
+        if loop is None:
+            self.reject(start, end)
+            return None
+        count, effects, counter, limit = loop
+
+        # iterations left: smallest m >= 1 with counter + m * step == limit (mod 256)
+        step = effects[counter][1] & 0xFF
+        distance = (reg[limit] - reg[counter]) & 0xFF
+        divisor = gcd(step, 256)
+        if distance % divisor:
+            # never terminates: run it normally from now on (it can still be paused)
+            self.reject(start, end)
+            return None
+        modulus = 256 // divisor
+        m = (distance // divisor) * pow(step // divisor, -1, modulus) % modulus
+
+        # this JNE is one instruction, then each iteration is `count`
+        room = cpu.deadline - cpu.cycles - 1
+        finished = m * count <= room
+        if not finished:
+            m = int(room // count)
+            if m <= 0:
+                return None
+
+        for r, (kind, value) in effects.items():
+            if kind == "const":
+                reg[r] = value & 0xFF
+            else:
+                reg[r] = (reg[r] + m * value) & 0xFF
+
+        if finished:
+            cpu.fl = cpu.FL_E
+            cpu.pc = (end + 2) & 0xFF
+        else:
+            # stopped early: the last CMP found them unequal and the JNE went back
+            x = reg[cpu.ram[end - 2]]
+            y = reg[cpu.ram[end - 1]]
+            cpu.fl = cpu.FL_L if x < y else cpu.FL_G
+            cpu.pc = start
+
+        self.stats["loops"] += 1
+        self.stats["iterations"] += m
+        return m * count
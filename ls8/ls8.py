@@ -2,14 +2,217 @@
 
 """Main."""
 
+import asyncio
+import contextlib
+import glob
+import json
+import os
+import signal
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from cpu import *
+from debugger import Shell
+from devices import MemoryOutput
+from keyboard import run_with_stdin
 
-cpu = CPU()
+USAGE = """usage: ls8.py [--jit | --fuse | --loops | --profile STACKS_FILE | --trace TRACE_FILE [--trace-size N] | --keyboard | --debug] [--fast-forward] filename
+       ls8.py --batch [--jit] [--jobs N] [--timeout SECONDS] [--inputs FILE] [--output FILE] file|glob ..."""
 
-if len(sys.argv) < 2:
-    print("usage: ls8.py filename")
-    sys.exit(1)
 
-cpu.load(sys.argv[1])
-cpu.run()
\ No newline at end of file
+# Most output a batch job keeps (characters); a program printing forever is cut off here
+OUTPUT_LIMIT = 1 << 20
+
+
+class Timeout(Exception):
+    pass
+
+
+def on_timeout(signum, frame):
+    raise Timeout()
+
+
+def run_program(job):
+    """
+    Batch worker: run one program (with an optional input set) and return its
+    result as a dict. Output is captured instead of printed.
+    """
+    filename, inputs, jit, timeout = job
+    result = {"file": filename}
+    if inputs is not None:
+        result["inputs"] = inputs
+
+    # program output and any stray prints both land here
+    output = MemoryOutput(OUTPUT_LIMIT)
+    cpu = CPU(output=output)
+    try:
+        cpu.load(filename)
+        for register, value in (inputs or {}).get("reg", {}).items():
+            cpu.reg[int(register)] = value & 0xFF
+        for address, value in (inputs or {}).get("ram", {}).items():
+            cpu.ram_write(int(address, 0), value)
+
+        if timeout:
+            signal.signal(signal.SIGALRM, on_timeout)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            with contextlib.redirect_stdout(output):
+                if jit:
+                    cpu.run_jit()
+                else:
+                    cpu.run()
+        finally:
+            if timeout:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        result["state"] = "halted"
+    except Timeout:
+        result["state"] = "timeout"
+    except (Exception, SystemExit) as e:
+        result["state"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    result["output"] = output.getvalue()
+    if output.truncated:
+        result["truncated"] = True
+    result["pc"] = cpu.pc
+    result["reg"] = list(cpu.reg)
+    return result
+
+
+def run_batch(args, jit):
+    """Run many programs across a process pool and write one JSON result per line."""
+    jobs_count = os.cpu_count()
+    timeout = None
+    inputs = [None]
+    output = sys.stdout
+    patterns = []
+
+    while args:
+        arg = args.pop(0)
+        if arg == "--jobs":
+            jobs_count = int(args.pop(0))
+        elif arg == "--timeout":
+            timeout = float(args.pop(0))
+        elif arg == "--inputs":
+            with open(args.pop(0)) as file:
+                inputs = [json.loads(line) for line in file if line.strip()]
+        elif arg == "--output":
+            output = open(args.pop(0), "w")
+        else:
+            patterns.append(arg)
+
+    files = []
+    for pattern in patterns:
+        files.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    if not files:
+        print(USAGE)
+        sys.exit(1)
+
+    jobs = [(filename, input_set, jit, timeout) for filename in files for input_set in inputs]
+    chunksize = max(1, len(jobs) // (jobs_count * 4))
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs_count) as executor:
+        for result in executor.map(run_program, jobs, chunksize=chunksize):
+            if result["state"] != "halted":
+                failed += 1
+            output.write(json.dumps(result) + "\n")
+    output.flush()
+
+    return 1 if failed else 0
+
+
+def main(argv):
+    args = argv[1:]
+    jit = "--jit" in args
+    if jit:
+        args.remove("--jit")
+
+    if "--batch" in args:
+        args.remove("--batch")
+        return run_batch(args, jit)
+
+    # real time is the default; --realtime is still accepted
+    if "--realtime" in args:
+        args.remove("--realtime")
+
+    fastForward = "--fast-forward" in args
+    if fastForward:
+        args.remove("--fast-forward")
+
+    keyboard = "--keyboard" in args
+    if keyboard:
+        args.remove("--keyboard")
+
+    debug = "--debug" in args
+    if debug:
+        args.remove("--debug")
+
+    profile = None
+    if "--profile" in args:
+        index = args.index("--profile")
+        profile = args[index + 1]
+        del args[index:index + 2]
+
+    fuse = "--fuse" in args
+    if fuse:
+        args.remove("--fuse")
+
+    loops = "--loops" in args
+    if loops:
+        args.remove("--loops")
+
+    trace = None
+    if "--trace" in args:
+        index = args.index("--trace")
+        trace = args[index + 1]
+        del args[index:index + 2]
+
+    traceSize = 65536
+    if "--trace-size" in args:
+        index = args.index("--trace-size")
+        traceSize = int(args[index + 1])
+        del args[index:index + 2]
+
+    if len(args) < 1:
+        print(USAGE)
+        sys.exit(1)
+
+    cpu = CPU()
+    # real time: the timer interrupt fires once per wall-clock second;
+    # fast-forward runs flat out and skips idle time
+    cpu.scheduler.setRealtime(not fastForward)
+    cpu.load(args[0])
+    if debug:
+        # interactive: breakpoints, watchpoints, stepping (see debugger.py)
+        Shell(cpu).cmdloop()
+    elif keyboard:
+        # key presses from stdin go to 0xF4 and raise I1
+        asyncio.run(run_with_stdin(cpu))
+    elif profile is not None:
+        # report on stderr so it doesn't mix with program output
+        profiler = cpu.run_profiled()
+        print(profiler.report(), file=sys.stderr, end='')
+        profiler.write_collapsed(profile)
+    elif trace is not None:
+        # last instructions go to the trace file on halt or crash; see replay.py
+        cpu.run_traced(traceSize, trace)
+    elif jit:
+        cpu.run_jit()
+    elif fuse or loops:
+        fusion = cpu.enable_fusion() if fuse else None
+        accelerator = cpu.enable_loops() if loops else None
+        cpu.run()
+        # what the speedups did, on stderr so it doesn't mix with program output
+        if fusion is not None:
+            print(fusion.report(), file=sys.stderr, end='')
+        if accelerator is not None:
+            print(f"{accelerator.stats['loops']} loops fast-forwarded, "
+                  f"{accelerator.stats['iterations']} iterations skipped", file=sys.stderr)
+    else:
+        cpu.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,161 @@
+"""Opt-in execution profiler for the LS-8 CPU."""
+
+import time
+from collections import defaultdict
+
+CALL = 0b01010000
+RET  = 0b00010001
+IRET = 0b00010011
+
+
+class Profiler:
+    """
+    Runs a CPU in a separate, instrumented loop and records:
+    * executions and cumulative time per opcode
+    * executions per PC (hotness histogram)
+    * a CALL/RET shadow stack with inclusive instruction counts and time per
+      subroutine, plus collapsed stacks for flame graph tools
+
+    The plain `CPU.run` loop is untouched, so it pays nothing for profiling.
+    """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+        # opcode -> executions / seconds
+        self.counts = defaultdict(int)
+        self.times = defaultdict(float)
+        # executions per address
+        self.hits = [0] * 256
+        # subroutine -> calls / inclusive instructions / inclusive seconds
+        self.calls = defaultdict(int)
+        self.inclusive = defaultdict(int)
+        self.inclusive_times = defaultdict(float)
+        # "main;sub_0C;sub_20" -> instructions executed with that stack
+        self.stacks = defaultdict(int)
+        # shadow stack of (name, instructions at entry, seconds at entry)
+        self.frames = [("main", 0, 0.0)]
+        self.instructions = 0
+        self.elapsed = 0.0
+        # entry address -> label, from the loaded image's symbol table
+        self.labels = {address: label for label, address in cpu.symbols.items()}
+
+    def name(self, address):
+        """Name a subroutine by its entry address, using the image's symbols when known."""
+        return self.labels.get(address, f"sub_{address:02X}")
+
+    def opname(self, opcode):
+        """Mnemonic for an opcode, taken from its handler's name."""
+        handler = self.cpu.branchtable.get(opcode)
+        if handler is None:
+            return f"{opcode:08b}"
+        return handler.__name__.replace("ALU_", "")
+
+    def enter(self, name):
+        self.calls[name] += 1
+        self.frames.append((name, self.instructions, self.elapsed))
+
+    def leave(self):
+        if len(self.frames) == 1:
+            # RET without a matching CALL: keep "main" at the bottom
+            return
+        name, instructions, elapsed = self.frames.pop()
+        self.inclusive[name] += self.instructions - instructions
+        self.inclusive_times[name] += self.elapsed - elapsed
+
+    def run(self):
+        """Run the CPU to completion under the profiler."""
+        cpu = self.cpu
+        reg = cpu.reg
+        ram = cpu.ram
+        decoded = cpu.decoded
+        decode = cpu.decode
+        counts = self.counts
+        times = self.times
+        hits = self.hits
+        stacks = self.stacks
+        clock = time.perf_counter
+        IM = cpu.IM
+        IS = cpu.IS
+        stack = ";".join(frame[0] for frame in self.frames)
+        cycles = cpu.cycles
+        # one plain instruction per entry, so opcode and CALL counts see every instruction
+        with cpu.plain_decoding():
+            try:
+                while cpu.canRun:
+                    # scheduled events (timer, run_slice pauses, spin fast-forward), as in CPU.run
+                    if cycles >= cpu.deadline:
+                        cpu.cycles = cycles
+                        cpu.scheduler.dispatch()
+                        cycles = cpu.cycles
+
+                    if reg[IM] & reg[IS] and cpu.canInterrupt:
+                        cpu.interrupt()
+                        self.enter(f"interrupt_{cpu.pc:02X}")
+                        stack = ";".join(frame[0] for frame in self.frames)
+
+                    pc = cpu.pc
+                    opcode = ram[pc]
+                    operation, operand_a, operand_b, length = decoded[pc] or decode(pc)
+
+                    start = clock()
+                    if length == 2:
+                        operation(cpu, operand_a)
+                    elif length == 3:
+                        operation(cpu, operand_a, operand_b)
+                    else:
+                        operation(cpu)
+                    cpu.pc = (cpu.pc + length) & 0xFF
+                    spent = clock() - start
+                    cycles += 1
+
+                    counts[opcode] += 1
+                    times[opcode] += spent
+                    hits[pc] += 1
+                    stacks[stack] += 1
+                    self.instructions += 1
+                    self.elapsed += spent
+
+                    if opcode == CALL:
+                        self.enter(self.name(cpu.pc))
+                        stack = ";".join(frame[0] for frame in self.frames)
+                    elif opcode == RET or opcode == IRET:
+                        self.leave()
+                        stack = ";".join(frame[0] for frame in self.frames)
+            finally:
+                cpu.cycles = cycles
+                cpu.output.flush()
+        return self
+
+    def report(self, top=10):
+        """Text report: opcodes by time, hottest addresses and subroutines."""
+        total = self.elapsed or 1.0
+        lines = [f"{self.instructions} instructions, {self.elapsed * 1000:.2f} ms in handlers", ""]
+
+        lines.append(f"{'opcode':<8} {'count':>10} {'ms':>9} {'%time':>6}")
+        for opcode in sorted(self.counts, key=self.times.get, reverse=True):
+            lines.append(f"{self.opname(opcode):<8} {self.counts[opcode]:>10} "
+                         f"{self.times[opcode] * 1000:>9.3f} {self.times[opcode] / total:>6.1%}")
+
+        lines.append("")
+        lines.append(f"{'pc':<8} {'count':>10}")
+        hottest = sorted(range(256), key=self.hits.__getitem__, reverse=True)[:top]
+        for pc in hottest:
+            if self.hits[pc]:
+                lines.append(f"{pc:02X}       {self.hits[pc]:>10}")
+
+        if self.calls:
+            lines.append("")
+            lines.append(f"{'subroutine':<20} {'calls':>8} {'incl. instr':>12} {'incl. ms':>9}")
+            for name in sorted(self.calls, key=self.inclusive.get, reverse=True):
+                lines.append(f"{name:<20} {self.calls[name]:>8} {self.inclusive[name]:>12} "
+                             f"{self.inclusive_times[name] * 1000:>9.3f}")
+
+        return "\n".join(lines) + "\n"
+
+    def collapsed(self):
+        """Collapsed stacks (`frame;frame count` per line), as read by flamegraph.pl and speedscope."""
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def write_collapsed(self, filename):
+        with open(filename, "w") as file:
+            file.write(self.collapsed())
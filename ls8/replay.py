@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+"""
+Offline decoder for LS-8 trace dumps (see tracer.py).
+
+    python replay.py trace.bin [--last N] [--pc ADDR]
+
+Replays the recorded instructions in order, printing each one with the
+registers and flags it changed.
+"""
+
+import sys
+
+from cpu import CPU
+from tracer import load_trace
+
+LDI = 0b10000010
+
+
+def mnemonics():
+    """opcode -> name, taken from the CPU's handler names."""
+    return {opcode: handler.__name__.replace("ALU_", "")
+            for opcode, handler in CPU().branchtable.items()}
+
+
+def describe(opcode, operand_a, operand_b, names):
+    """Disassemble one recorded instruction."""
+    name = names.get(opcode, f"{opcode:08b}")
+    operands = opcode >> 6
+    if opcode == LDI:
+        return f"{name} R{operand_a},{operand_b:02X}"
+    if operands == 1:
+        return f"{name} R{operand_a}"
+    if operands == 2:
+        return f"{name} R{operand_a},R{operand_b}"
+    return name
+
+
+def replay(records, names, pc=None):
+    """Yield one text line per record, with register and flag changes."""
+    previous = None
+    for cycle, address, opcode, operand_a, operand_b, fl, *reg in records:
+        if previous is None:
+            changes = " ".join(f"R{i}={value:02X}" for i, value in enumerate(reg))
+            changes += f" FL={fl:08b}"
+        else:
+            changes = " ".join(f"R{i}={value:02X}" for i, value in enumerate(reg)
+                               if value != previous[1][i])
+            if fl != previous[0]:
+                changes += f" FL={fl:08b}"
+        previous = (fl, reg)
+        if pc is not None and address != pc:
+            continue
+        yield (f"{cycle:>10} {address:02X}: {describe(opcode, operand_a, operand_b, names):<14}"
+               f" {changes.strip()}")
+
+
+def main(argv):
+    args = argv[1:]
+    last = None
+    pc = None
+    files = []
+
+    while args:
+        arg = args.pop(0)
+        if arg == "--last":
+            last = int(args.pop(0))
+        elif arg == "--pc":
+            pc = int(args.pop(0), 16)
+        else:
+            files.append(arg)
+
+    if len(files) != 1:
+        print("usage: replay.py trace.bin [--last N] [--pc ADDR]")
+        return 1
+
+    total, records = load_trace(files[0])
+    print(f"{len(records)} of {total} instructions recorded")
+    if last is not None:
+        records = records[-last:]
+    for line in replay(records, mnemonics(), pc):
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,122 @@
+"""Cycle-counted event scheduler for the LS-8 CPU."""
+
+import heapq
+import itertools
+import time
+
+# Deadline used when nothing is scheduled
+NEVER = float("inf")
+
+
+class Scheduler:
+    """
+    Min-heap of future events keyed by CPU cycle count (timer ticks, device events).
+
+    The CPU compares its cycle count against `cpu.deadline` (the earliest event)
+    once per instruction and only calls `dispatch` when that deadline is reached.
+
+    Modes:
+    * fast-forward (default): when the program is idle (spinning on a JMP to
+      itself) the cycle count jumps straight to the next event.
+    * real time: `cyclesPerSecond` cycles take one second of wall time. The CPU
+      sleeps at event boundaries whenever it is ahead of the wall clock.
+    """
+
+    def __init__(self, cpu, cyclesPerSecond=1_000_000, realtime=False):
+        self.cpu = cpu
+        self.cyclesPerSecond = cyclesPerSecond
+        self.realtime = realtime
+        self.fastForward = True
+        # [cycle, sequence, callback, repeat interval or None]
+        self.events = []
+        self.sequence = itertools.count()
+        # (cycle, wall time) that real-time mode measures from
+        self.origin = None
+
+    def schedule(self, cycle, callback, interval=None):
+        """
+        Call `callback(cpu)` once the CPU reaches `cycle`, and then every
+        `interval` cycles if one is given. Returns the event, for `cancel`.
+        """
+        event = [cycle, next(self.sequence), callback, interval]
+        heapq.heappush(self.events, event)
+        self.cpu.deadline = self.events[0][0]
+        return event
+
+    def after(self, cycles, callback, interval=None):
+        """Schedule `callback` `cycles` cycles from now."""
+        return self.schedule(self.cpu.cycles + cycles, callback, interval)
+
+    def every(self, interval, callback):
+        """Call `callback` every `interval` cycles, starting `interval` cycles from now."""
+        return self.after(interval, callback, interval)
+
+    def cancel(self, event):
+        """Stop a scheduled event from firing (it is dropped when its cycle comes)."""
+        event[2] = None
+        event[3] = None
+
+    def save(self):
+        """Pending events as (cycles from now, callback, interval) tuples, for snapshots."""
+        now = self.cpu.cycles
+        return tuple((cycle - now, callback, interval)
+                     for cycle, _, callback, interval in sorted(self.events)
+                     if callback is not None)
+
+    def load(self, events):
+        """Replace the pending events with ones from `save`, relative to the CPU's current cycle."""
+        now = self.cpu.cycles
+        self.events = [[now + offset, next(self.sequence), callback, interval]
+                       for offset, callback, interval in events]
+        heapq.heapify(self.events)
+        self.cpu.deadline = self.events[0][0] if self.events else NEVER
+
+    def secondsUntilNext(self):
+        """Wall time until the next event is due in real-time mode (None if nothing is scheduled)."""
+        if not self.events:
+            return None
+        if self.origin is None:
+            return 0.0
+        originCycle, originTime = self.origin
+        due = originTime + (self.events[0][0] - originCycle) / self.cyclesPerSecond
+        return max(0.0, due - time.monotonic())
+
+    def setRealtime(self, realtime):
+        """Switch real-time mode; wall time is measured from the current cycle."""
+        self.realtime = realtime
+        self.origin = (self.cpu.cycles, time.monotonic())
+
+    def wait(self, cycle):
+        """In real-time mode, sleep until the wall time that `cycle` maps to."""
+        if self.origin is None:
+            self.origin = (self.cpu.cycles, time.monotonic())
+            return
+        originCycle, originTime = self.origin
+        delay = originTime + (cycle - originCycle) / self.cyclesPerSecond - time.monotonic()
+        if delay > 0:
+            # nothing else is written until after the sleep: don't hold output back over it
+            self.cpu.output.flush()
+            time.sleep(delay)
+
+    def dispatch(self):
+        """Fire every event that is due, fast-forwarding first if the CPU is idle."""
+        cpu = self.cpu
+        events = self.events
+
+        if cpu.idle:
+            cpu.idle = False
+            if events and events[0][0] > cpu.cycles:
+                cpu.cycles = events[0][0]
+
+        while events and events[0][0] <= cpu.cycles:
+            cycle, _, callback, interval = heapq.heappop(events)
+            if callback is None:
+                # cancelled
+                continue
+            if self.realtime:
+                self.wait(cycle)
+            callback(cpu)
+            if interval:
+                heapq.heappush(events, [cycle + interval, next(self.sequence), callback, interval])
+
+        cpu.deadline = events[0][0] if events else NEVER
@@ -0,0 +1,139 @@
+"""Always-on binary execution trace for the LS-8 CPU."""
+
+import struct
+
+"""
+Trace records
+
+One fixed-size record per executed instruction, packed into a preallocated
+ring buffer: cycle count (4 bytes), PC, opcode, the two bytes after the opcode
+(read before the instruction ran), FL, then R0-R7 after the instruction ran
+(or as it left them, if it raised). Register deltas are the difference
+between consecutive records, worked out offline by replay.py, so the hot loop
+does a single pack_into per instruction.
+
+A dump file is a header (magic "LS8T", version, records in the file, total
+records ever written) followed by the records, oldest first. Little-endian.
+"""
+TRACE_MAGIC = b"LS8T"
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct("<4sBIQ")
+RECORD = struct.Struct("<IBBBBB8B")
+
+
+def pack_record(buffer, offset, cycles, pc, opcode, operand_a, operand_b, fl, reg):
+    """Write one record into `buffer` at `offset`."""
+    try:
+        RECORD.pack_into(buffer, offset, cycles & 0xFFFFFFFF, pc, opcode, operand_a, operand_b,
+                         fl, *reg)
+    except struct.error:
+        # a register outside 0-255; record its low byte
+        RECORD.pack_into(buffer, offset, cycles & 0xFFFFFFFF, pc, opcode, operand_a, operand_b,
+                         fl, *(value & 0xFF for value in reg))
+
+
+class Tracer:
+    """
+    Runs a CPU in a loop that records every instruction into a ring buffer of
+    the last `size` records. When the CPU halts, or the program crashes, the
+    buffer is written to `dumpfile` (if one is given) for a post-mortem.
+
+    Like the profiler, this is a separate loop, so `CPU.run` pays nothing.
+    """
+
+    def __init__(self, cpu, size=65536, dumpfile=None):
+        self.cpu = cpu
+        self.size = size
+        self.dumpfile = dumpfile
+        self.buffer = bytearray(size * RECORD.size)
+        # records ever written; the next one goes to slot count % size
+        self.count = 0
+
+    def run(self):
+        """Run the CPU to completion, tracing every instruction."""
+        cpu = self.cpu
+        reg = cpu.reg
+        ram = cpu.ram
+        decoded = cpu.decoded
+        decode = cpu.decode
+        IM = cpu.IM
+        IS = cpu.IS
+        buffer = self.buffer
+        recordSize = RECORD.size
+        end = len(buffer)
+        offset = (self.count % self.size) * recordSize
+        count = self.count
+        cycles = cpu.cycles
+        # one plain instruction per entry: fused or fast-forwarded runs would skip records
+        with cpu.plain_decoding():
+            try:
+                while cpu.canRun:
+                    if cycles >= cpu.deadline:
+                        cpu.cycles = cycles
+                        cpu.scheduler.dispatch()
+                        cycles = cpu.cycles
+
+                    if reg[IM] & reg[IS] and cpu.canInterrupt:
+                        cpu.interrupt()
+
+                    pc = cpu.pc
+                    # the instruction as fetched: it may overwrite itself, or raise
+                    opcode = ram[pc]
+                    byte1 = ram[(pc + 1) & 0xFF]
+                    byte2 = ram[(pc + 2) & 0xFF]
+                    try:
+                        operation, operand_a, operand_b, length = decoded[pc] or decode(pc)
+
+                        if length == 2:
+                            operation(cpu, operand_a)
+                        elif length == 3:
+                            operation(cpu, operand_a, operand_b)
+                        else:
+                            operation(cpu)
+                    except BaseException:
+                        # keep the faulting instruction in the post-mortem
+                        pack_record(buffer, offset, cycles + 1, pc, opcode, byte1, byte2, cpu.fl, reg)
+                        count += 1
+                        raise
+
+                    cpu.pc = (cpu.pc + length) & 0xFF
+                    cycles += 1
+
+                    pack_record(buffer, offset, cycles, pc, opcode, byte1, byte2, cpu.fl, reg)
+                    offset += recordSize
+                    if offset == end:
+                        offset = 0
+                    count += 1
+            finally:
+                cpu.cycles = cycles
+                self.count = count
+                cpu.output.flush()
+                if self.dumpfile is not None:
+                    self.dump(self.dumpfile)
+        return self
+
+    def records(self):
+        """The recorded bytes, oldest record first."""
+        if self.count <= self.size:
+            return bytes(self.buffer[:self.count * RECORD.size])
+        split = (self.count % self.size) * RECORD.size
+        return bytes(self.buffer[split:] + self.buffer[:split])
+
+    def dump(self, filename):
+        """Write the buffer to `filename` in the trace file format."""
+        with open(filename, "wb") as file:
+            file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION,
+                                         min(self.count, self.size), self.count))
+            file.write(self.records())
+
+
+def load_trace(filename):
+    """Read a trace dump. Returns (total records written, list of record tuples)."""
+    with open(filename, "rb") as file:
+        magic, version, stored, total = TRACE_HEADER.unpack(file.read(TRACE_HEADER.size))
+        if magic != TRACE_MAGIC:
+            raise Exception(f"{filename} is not an LS-8 trace")
+        if version != TRACE_VERSION:
+            raise Exception(f"Unsupported trace version {version}")
+        data = file.read(stored * RECORD.size)
+    return total, list(RECORD.iter_unpack(data))